@@ -9,6 +9,17 @@ if not os.environ.get("ENV"):
 class Config(object):
     DATASET_DIR = getenv("DATASET_DIR")
     DATASET_DB_DIR = getenv('DATASET_DB_DIR')
+    INGEST_MANIFEST = getenv('INGEST_MANIFEST', os.path.join(DATASET_DB_DIR or '.', 'manifest.json'))
+    INGEST_WORKERS = int(getenv('INGEST_WORKERS', 1))
+    INGEST_BATCH_SIZE = int(getenv('INGEST_BATCH_SIZE', 256))
+    INGEST_MAX_PENDING = int(getenv('INGEST_MAX_PENDING', 2 * INGEST_WORKERS))
+    # 'fast' or 'full' docling pipeline, optionally per file type as "pdf:full,docx:fast"
+    INGEST_PROFILE = getenv('INGEST_PROFILE', 'full')
+    INGEST_PROFILE_TYPES = dict(
+        item.strip().lower().split(':', 1) for item in getenv('INGEST_PROFILE_TYPES', '').split(',') if item.strip()
+    )
+    INGEST_DEVICE = getenv('INGEST_DEVICE', 'auto')
+    INGEST_THREADS = int(getenv('INGEST_THREADS', max(1, (os.cpu_count() or 1) // INGEST_WORKERS)))
     
     EMBEDDING_MODEL = getenv('EMBEDDING_MODEL', 'BAAI/bge-m3')
     EMBEDDING_TOKENS = int(getenv('EMBEDDING_TOKENS', 8192))
@@ -18,6 +29,116 @@ class Config(object):
     GOOGLE_API_KEY = getenv('GOOGLE_API_KEY')
     TAVILY_API_KEY = getenv('TAVILY_API_KEY')
 
+    # recent chat messages kept verbatim in prompts, older ones are summarized
+    HISTORY_TOKEN_BUDGET = int(getenv('HISTORY_TOKEN_BUDGET', 2000))
+    HISTORY_MAX_MESSAGES = int(getenv('HISTORY_MAX_MESSAGES', 12))
+    HISTORY_SUMMARY_BATCH = int(getenv('HISTORY_SUMMARY_BATCH', 20))
+
+    # 'llm' routes every question with the json llm, 'embedding' routes questions without
+    # chat history locally and only asks the llm when the similarities are not conclusive
+    ROUTER_MODE = getenv('ROUTER_MODE', 'llm')
+    ROUTER_PROTOTYPES = getenv('ROUTER_PROTOTYPES')
+    ROUTER_MIN_SIMILARITY = float(getenv('ROUTER_MIN_SIMILARITY', 0.5))
+    ROUTER_MARGIN = float(getenv('ROUTER_MARGIN', 0.08))
+    ROUTER_CORPUS_THRESHOLD = float(getenv('ROUTER_CORPUS_THRESHOLD', 0.7))
+
+    # search the vectorstore while routing, the results are dropped for other routes
+    SPECULATIVE_RETRIEVAL = getenv('SPECULATIVE_RETRIEVAL', 'true').lower() == 'true'
+
+    # documents kept in the graph state across web search retries
+    MAX_CONTEXT_DOCS = int(getenv('MAX_CONTEXT_DOCS', 8))
+    GRADE_CACHE_SIZE = int(getenv('GRADE_CACHE_SIZE', 1024))
+
+    # 'concurrent' grades each document with its own llm call, 'batch' grades all in one call,
+    # 'rerank' scores them with a local cross-encoder instead of the llm
+    DOC_GRADING_MODE = getenv('DOC_GRADING_MODE', 'concurrent')
+    DOC_GRADING_CONCURRENCY = int(getenv('DOC_GRADING_CONCURRENCY', 4))
+
+    RERANK_MODEL = getenv('RERANK_MODEL', 'cross-encoder/ms-marco-MiniLM-L-6-v2')
+    RERANK_MAX_LENGTH = int(getenv('RERANK_MAX_LENGTH', 512))
+    RERANK_BATCH_SIZE = int(getenv('RERANK_BATCH_SIZE', 32))
+    RERANK_FETCH_K = int(getenv('RERANK_FETCH_K', 20))
+    RERANK_TOP_N = int(getenv('RERANK_TOP_N', 4))
+    RERANK_THRESHOLD = float(getenv('RERANK_THRESHOLD', 0.5))
+    RERANK_MIN_DOCS = int(getenv('RERANK_MIN_DOCS', 1))
+
+    # 'sequential', 'parallel' or 'combined' hallucination and answer grading
+    GENERATION_GRADING_MODE = getenv('GENERATION_GRADING_MODE', 'sequential')
+
+    # 'dense' or 'hybrid' (dense + BM25 fused by reciprocal rank) retrieval
+    SEARCH_MODE = getenv('SEARCH_MODE', 'dense')
+    HYBRID_FETCH_MULTIPLIER = int(getenv('HYBRID_FETCH_MULTIPLIER', 3))
+    RRF_K = int(getenv('RRF_K', 60))
+
+    # query embedding and retrieval result caches of the vectorstore
+    QUERY_CACHE_SIZE = int(getenv('QUERY_CACHE_SIZE', 2048))
+    RETRIEVAL_CACHE_SIZE = int(getenv('RETRIEVAL_CACHE_SIZE', 1024))
+
+    # retrieved context packed into the prompts, 0 disables compression
+    CONTEXT_TOKEN_BUDGET = int(getenv('CONTEXT_TOKEN_BUDGET', 6000))
+    CONTEXT_PASSAGE_TOKENS = int(getenv('CONTEXT_PASSAGE_TOKENS', 200))
+    CONTEXT_MAX_PASSAGES = int(getenv('CONTEXT_MAX_PASSAGES', 48))
+    PASSAGE_CACHE_SIZE = int(getenv('PASSAGE_CACHE_SIZE', 8192))
+
+    # 'tavily' or 'fixture' (offline results from a JSON file) web search
+    WEB_SEARCH_BACKEND = getenv('WEB_SEARCH_BACKEND', 'tavily')
+    WEB_SEARCH_FIXTURES = getenv('WEB_SEARCH_FIXTURES')
+    WEB_SEARCH_FIXTURE_LATENCY = float(getenv('WEB_SEARCH_FIXTURE_LATENCY', 0))
+    WEB_CACHE_SIZE = int(getenv('WEB_CACHE_SIZE', 512))
+    WEB_CACHE_TTL = int(getenv('WEB_CACHE_TTL', 900))
+
+    # semantic cache of grounded answers, size 0 disables it
+    ANSWER_CACHE_SIZE = int(getenv('ANSWER_CACHE_SIZE', 1000))
+    ANSWER_CACHE_TTL = int(getenv('ANSWER_CACHE_TTL', 86400))
+    ANSWER_CACHE_THRESHOLD = float(getenv('ANSWER_CACHE_THRESHOLD', 0.92))
+
+    # results of temperature 0 llm calls reused for identical prompts
+    LLM_CACHE_SIZE = int(getenv('LLM_CACHE_SIZE', 2048))
+    LLM_CACHE_TTL = int(getenv('LLM_CACHE_TTL', 300))
+
+    # llm provider: cloud, local or fake (offline canned responses for load testing)
+    LLM_MODE = getenv('LLM_MODE', 'cloud')
+    # per provider limits, rates are requests per second (0 is unlimited)
+    LLM_RATE_LIMIT = float(getenv('LLM_RATE_LIMIT', 0))
+    LLM_RATE_LIMITS = {
+        provider.strip().lower(): float(rate) for provider, rate in (
+            item.split(':', 1) for item in getenv('LLM_RATE_LIMITS', '').split(',') if item.strip()
+        )
+    }
+    LLM_BURST = int(getenv('LLM_BURST', 5))
+    LLM_MAX_CONCURRENCY = int(getenv('LLM_MAX_CONCURRENCY', 8))
+    LLM_MAX_QUEUE = int(getenv('LLM_MAX_QUEUE', 100))
+    LLM_TARGET_LATENCY = float(getenv('LLM_TARGET_LATENCY', 10))
+    LLM_MAX_RETRIES = int(getenv('LLM_MAX_RETRIES', 3))
+    LLM_BACKOFF_BASE = float(getenv('LLM_BACKOFF_BASE', 0.5))
+    LLM_BACKOFF_MAX = float(getenv('LLM_BACKOFF_MAX', 8))
+    FAKE_LLM_LATENCY = float(getenv('FAKE_LLM_LATENCY', 0.5))
+    FAKE_LLM_ERROR_RATE = float(getenv('FAKE_LLM_ERROR_RATE', 0))
+
+    # secondary providers (e.g. "local") hedged against and failed over to
+    LLM_SECONDARY = [mode.strip() for mode in getenv('LLM_SECONDARY', '').split(',') if mode.strip()]
+    HEDGE_ENABLED = getenv('HEDGE_ENABLED', 'true').lower() == 'true'
+    HEDGE_PERCENTILE = float(getenv('HEDGE_PERCENTILE', 95))
+    HEDGE_MIN_DELAY = float(getenv('HEDGE_MIN_DELAY', 0.5))
+    HEDGE_DEFAULT_DELAY = float(getenv('HEDGE_DEFAULT_DELAY', 5))
+    HEDGE_MIN_SAMPLES = int(getenv('HEDGE_MIN_SAMPLES', 20))
+    HEDGE_WINDOW = int(getenv('HEDGE_WINDOW', 200))
+    FAILOVER_ERROR_RATE = float(getenv('FAILOVER_ERROR_RATE', 0.5))
+    FAILOVER_MIN_CALLS = int(getenv('FAILOVER_MIN_CALLS', 10))
+    FAILOVER_COOLDOWN = int(getenv('FAILOVER_COOLDOWN', 30))
+
+    # postgres connection pool
+    PG_POOL_MIN = int(getenv('PG_POOL_MIN', 2))
+    PG_POOL_MAX = int(getenv('PG_POOL_MAX', 10))
+
+    # write-through cache of recent chat histories, 0 bytes disables it
+    CHAT_CACHE_MAX_BYTES = int(getenv('CHAT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    CHAT_CACHE_IDLE = int(getenv('CHAT_CACHE_IDLE', 1800))
+
+    # keyset paginated listings (chats, messages, users)
+    PAGE_SIZE = int(getenv('PAGE_SIZE', 50))
+    MAX_PAGE_SIZE = int(getenv('MAX_PAGE_SIZE', 200))
+
     TOKENIZERS_PARALLELISM = getenv('TOKENIZERS_PARALLELISM', 'true')
 
     DATABASE_URL = getenv('DATABASE_URL', None)
@@ -1,3 +1,12 @@
-from rag.core.llm import LLM
+from config import Config
 
-llm = LLM()
+
+def __getattr__(name):
+    # the llm clients are built on first use, so processes that only need part of
+    # the package (e.g. ingestion workers importing the converter) skip them
+    if name == "llm":
+        global llm
+        from rag.core.llm import LLM
+        llm = LLM(Config.LLM_MODE)
+        return llm
+    raise AttributeError(f"module 'rag' has no attribute '{name}'")
@@ -1,22 +1,18 @@
-import uvicorn
-
-from rag.data_utils.vectorstore import db
-from rag.data_utils.document import doc_handler
-from rag.api import app
-from rag.utils import get_all_files
-
-
-
 if __name__ == "__main__":
+    # imported here so ingestion worker processes, which re-import
+    # this module, do not load the server and embedding model
+    import uvicorn
+
+    from config import Config
+    from rag.data_utils.vectorstore import db
+    from rag.data_utils.ingest import ingestor
+    from rag.api import app
     
     while(True):
         opt = int(input("1:Process Data  2:Run Server  3:List Files\nEnter the option to run : "))
         if opt == 1:
-            unfiles = get_all_files('/teamspace/studios/this_studio/notes')
-            for file in unfiles:
-                doc = doc_handler.convert(file)
-                for d in doc:
-                    db.add_datas(d)
+            stats = ingestor.sync(Config.DATASET_DIR or '/teamspace/studios/this_studio/notes')
+            print(stats)
         elif opt == 2:
             uvicorn.run(app, host="0.0.0.0", port=5000)
         elif opt == 3:
@@ -1,20 +1,28 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Query, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from typing import List, Optional, Dict
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 import os
+import json
+import asyncio
+import uuid
 
+from config import Config
 from rag.core.ai import AI
 from rag.data_utils.pg_db import pgdb
+from rag.metrics import metrics
+from rag.utils import get_tokenizer
 from rag.types import *
 
 # Security configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "supersecretkey")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+LAST_MESSAGE_PREVIEW = 50  # characters of a chat's last message listed by /chats
 
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -28,6 +36,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 ai_instance = AI()
@@ -142,6 +151,8 @@ async def read_users_me(current_user: User = Depends(get_current_active_user)):
 @app.on_event("startup")
 async def startup_event():
     await pgdb.connect()
+    # load the tokenizer now rather than on the event loop during the first chat
+    await asyncio.to_thread(get_tokenizer)
 
 # Updated Chat Endpoints that use authentication
 @app.post("/chat", response_model=MessageResponse)
@@ -154,11 +165,9 @@ async def chat(request: MessageRequest, current_user: User = Depends(get_current
             
         chat_id = request.chatId
         
-        # If no chatId provided, create a new chat
-        if not chat_id:
-            chat = await pgdb.get_or_create_chat(request.userId)
-            chat_id = chat['chatId']
-        
+        # If no chatId provided, the turn creates a new chat
+        chat_id = chat_id or str(uuid.uuid4())
+
         response = await ai_instance.generate(
             user_id=request.userId,
             chat_id=chat_id,
@@ -169,29 +178,65 @@ async def chat(request: MessageRequest, current_user: User = Depends(get_current
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing message: {str(e)}")
 
+@app.post("/chat/stream")
+async def chat_stream(request: MessageRequest, current_user: User = Depends(get_current_active_user)):
+    """Process a chat message and stream progress and answer tokens as server-sent events"""
+    # Ensure the user ID in request matches the authenticated user
+    if request.userId != current_user.username:
+        raise HTTPException(status_code=403, detail="Access denied: User ID mismatch")
+
+    # If no chatId provided, the turn creates a new chat
+    chat_id = request.chatId or str(uuid.uuid4())
+
+    async def event_stream():
+        try:
+            async for event, data in ai_instance.generate_stream(
+                user_id=request.userId,
+                chat_id=chat_id,
+                query=request.message
+            ):
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        except Exception as e:
+            detail = json.dumps({"detail": f"Error processing message: {str(e)}"})
+            yield f"event: error\ndata: {detail}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/chats", response_model=List[Chat])
-async def get_chat_history(current_user: User = Depends(get_current_active_user)):
-    """Get chat history for a user"""
+async def get_chat_history(
+    response: Response,
+    limit: int = Query(Config.PAGE_SIZE, ge=1, le=Config.MAX_PAGE_SIZE),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    current_user: User = Depends(get_current_active_user)
+):
+    """Get chat history for a user, latest first. X-Next-Cursor is the before cursor of older chats"""
     try:
         userId = current_user.username
-        chats = await pgdb.get_all_chats(userId)
+        chats, next_cursor = await pgdb.get_chats_page(userId, limit, before, after, preview=LAST_MESSAGE_PREVIEW)
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
             
         # Transform to response format
         result = []
         for chat in chats:
-            last_message = await pgdb.get_last_message(chat['chat_id'])
-            
-            last_message_content = last_message["content"] if last_message else None
+            last_message_content = chat["last_message"]
             
             result.append({
                 "id": chat["chat_id"],
                 "title": chat["title"],
                 "username": chat["username"],
                 "createdAt": chat["last_updated"].isoformat() if chat["last_updated"] else None,
-                "lastMessage": last_message_content[:50] + "..." if last_message_content and len(last_message_content) > 50 else last_message_content
+                "lastMessage": last_message_content[:LAST_MESSAGE_PREVIEW] + "..." if last_message_content and len(last_message_content) > LAST_MESSAGE_PREVIEW else last_message_content
             })
             
         return result
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching chat history: {str(e)}")
 
@@ -208,7 +253,15 @@ async def create_chat(request: ChatCreateRequest, current_user: User = Depends(g
         raise HTTPException(status_code=500, detail=f"Error creating chat: {str(e)}")
 
 @app.get("/chats/{chatId}/messages", response_model=List[Message])
-async def get_chat_messages(chatId: str, current_user: User = Depends(get_current_active_user)):
+async def get_chat_messages(
+    chatId: str,
+    response: Response,
+    limit: int = Query(Config.PAGE_SIZE, ge=1, le=Config.MAX_PAGE_SIZE),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    current_user: User = Depends(get_current_active_user)
+):
+    """Get messages of a chat, oldest first. The first page holds the latest messages and X-Next-Cursor is the before cursor of older ones"""
     try:
         userId = current_user.username
         
@@ -219,7 +272,9 @@ async def get_chat_messages(chatId: str, current_user: User = Depends(get_curren
         """if not chat or chat["user_id"] != userId:
             raise HTTPException(status_code=403, detail="Access denied to this chat")"""
             
-        messages = await pgdb.get_all_messages(chatId)
+        messages, next_cursor = await pgdb.get_messages_page(chatId, limit, before, after)
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
         
         result = []
         for msg in messages:
@@ -234,6 +289,8 @@ async def get_chat_messages(chatId: str, current_user: User = Depends(get_curren
         return result
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching messages: {str(e)}")
 
@@ -266,13 +323,21 @@ async def update_chat(chatId: str, request: ChatUpdateRequest, current_user: Use
 
 # Admin only endpoints
 @app.get("/admin/users", response_model=List[User])
-async def get_all_users(current_user: User = Depends(get_current_active_user)):
+async def get_all_users(
+    response: Response,
+    limit: int = Query(Config.PAGE_SIZE, ge=1, le=Config.MAX_PAGE_SIZE),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    current_user: User = Depends(get_current_active_user)
+):
+    """List users in registration order. X-Next-Cursor is the after cursor of the next page"""
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Admin access required")
     
     try:
-        async with pgdb.db.acquire() as conn:
-            rows = await conn.fetch("SELECT * FROM users")
+        rows, next_cursor = await pgdb.get_users_page(limit, before, after)
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
         
         users = []
         for row in rows:
@@ -285,5 +350,14 @@ async def get_all_users(current_user: User = Depends(get_current_active_user)):
             ))
         
         return users
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching users: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error fetching users: {str(e)}")
+
+@app.get("/admin/metrics")
+async def get_metrics(current_user: User = Depends(get_current_active_user)):
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+    return metrics.snapshot()
\ No newline at end of file
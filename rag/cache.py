@@ -0,0 +1,81 @@
+import time
+import threading
+
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Bounded least recently used cache with an optional time to live (seconds).
+    Safe to share between the event loop and executor threads.
+    """
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+
+    def get(self, key, default=None):
+        with self.lock:
+            item = self.data.get(key)
+            if item is not None:
+                value, expires = item
+                if expires is None or expires > time.monotonic():
+                    self.data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.data[key]
+            self.misses += 1
+            return default
+
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self.lock:
+            self.data[key] = (value, expires)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+
+    def pop(self, key, default=None):
+        with self.lock:
+            item = self.data.pop(key, None)
+        return item[0] if item else default
+
+
+    def items(self) -> list:
+        """
+        Returns
+            items: list of (key, value) that have not expired, without touching recency
+        """
+        now = time.monotonic()
+        with self.lock:
+            expired = [key for key, (_, expires) in self.data.items() if expires is not None and expires <= now]
+            for key in expired:
+                del self.data[key]
+            return [(key, value) for key, (value, _) in self.data.items()]
+
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self.data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+    def __len__(self):
+        return len(self.data)
@@ -3,10 +3,17 @@ from langgraph.graph import END
 
 from rag.types import GraphState
 from rag.data_utils.pg_db import pgdb
+from rag.core.answer_cache import answer_cache
+from rag.core.history import history
+from rag.metrics import metrics
 
+from config import Config
 from .funcs import web_search, retrieve, grade_documents, generate, route_question, \
-    grade_generation_v_documents_and_question, decide_to_generate, simple_generate
+    grade_generation_v_documents_and_question, decide_to_generate, simple_generate, accept_generation, \
+    rerank_documents, decide_route, decide_after_web_search
 
+# graph nodes whose llm output is the answer streamed to the user
+GENERATION_NODES = ("generate", "simple_generate")
 
 
 class AI:
@@ -26,19 +33,25 @@ class AI:
 
         workflow = StateGraph(GraphState)
 
+        workflow.add_node("route", route_question)
         workflow.add_node("websearch", web_search)
         workflow.add_node("retrieve", retrieve)
-        workflow.add_node("grade_documents", grade_documents)
+        workflow.add_node("grade_documents", rerank_documents if Config.DOC_GRADING_MODE == "rerank" else grade_documents)
         workflow.add_node("generate", generate)
         workflow.add_node("simple_generate", simple_generate)
+        workflow.add_node("accept_generation", accept_generation)
 
-        workflow.set_conditional_entry_point(route_question, {
+        workflow.set_entry_point("route")
+        workflow.add_conditional_edges("route", decide_route, {
             "websearch": "websearch",
             "vectorstore": "retrieve",
             "generate": "simple_generate"
         })
 
-        workflow.add_edge("websearch", "generate")
+        workflow.add_conditional_edges("websearch", decide_after_web_search, {
+            "generate": "generate",
+            "exhausted": END,
+        })
         workflow.add_edge("retrieve", "grade_documents")
         workflow.add_conditional_edges(
             "grade_documents", 
@@ -52,42 +65,148 @@ class AI:
             grade_generation_v_documents_and_question, 
             {
                 "not supported": "generate", 
-                "useful": END, 
+                "useful": "accept_generation", 
                 "not useful": "websearch", 
                 "max retries": END,
             }
         )
         workflow.add_edge("simple_generate", END)
+        workflow.add_edge("accept_generation", END)
 
         compiled_graph = workflow.compile()
         self.user_graphs[user_id] = compiled_graph  # Store compiled graph per user
         return compiled_graph
 
-    async def generate(self, user_id: str, chat_id: str, query: str, max_retries=3):
-        await pgdb.get_or_create_user(user_id)
-        chat = await pgdb.get_or_create_chat(user_id, chat_id)
-
-        # Append user message
-        await pgdb.save_message(chat['chatId'], "human", query)
+    def report_loops(self, final_state: dict) -> int:
+        """
+        Records how many generations the turn took
+        """
+        loop_step = final_state.get("loop_step", 0)
+        metrics.observe("graph.loop_step", loop_step)
+        if loop_step > 1:
+            metrics.incr("graph.retries", loop_step - 1)
+        print(f"---TURN FINISHED AFTER {loop_step} GENERATION(S)---")
+        return loop_step
+
+    @staticmethod
+    def cacheable(final_state: dict) -> bool:
+        """
+        Only answers grounded in the vectorstore alone are cached, web results
+        go stale long before Config.ANSWER_CACHE_TTL
+        """
+        if not final_state.get("grounded") or final_state.get("route") != "vectorstore":
+            return False
+        return not any(d.metadata.get("source") == "web" for d in final_state.get("documents") or [])
+
+    async def start_turn(self, user_id: str, chat_id: str, query: str, max_retries=3):
+        """
+        Stores the user message and builds the graph input for a chat turn
+        Returns:
+            chat_id, input_state
+        """
+        # user and chat upsert, user message and history in one transaction
+        chat_id, messages, summary, covered = await pgdb.begin_turn(user_id, chat_id, query)
+        summary, recent = await history.load(chat_id, messages, (summary, covered))
 
         input_state = {
             "question": query,
             "max_retries": max_retries,
-            "chat_history": await pgdb.get_chat_messages(chat['chatId']),
+            "chat_history": recent,
+            "history_summary": summary,
             "loop_step": 0,
             "user_id": user_id,
-            "chat_id": chat['chatId'],
+            "chat_id": chat_id,
         }
+        return chat_id, input_state
+
+    async def generate(self, user_id: str, chat_id: str, query: str, max_retries=3):
+        chat_id, input_state = await self.start_turn(user_id, chat_id, query, max_retries)
+
+        cached = await answer_cache.lookup(query, input_state["chat_history"])
+        if cached:
+            await pgdb.finish_turn(chat_id, cached)
+            return cached
 
         graph = await self.get_or_create_graph(user_id)  # Fetch cached user-specific graph
 
         final_state = None
-        for event in graph.stream(input_state, stream_mode="values"):
+        async for event in graph.astream(input_state, stream_mode="values"):
             final_state = event
 
+        if final_state:
+            self.report_loops(final_state)
+
         if final_state and "generation" in final_state:
             response = final_state["generation"].content
-            await pgdb.save_message(chat['chatId'], "assistant", response)
+            await pgdb.finish_turn(chat_id, response)
+            if self.cacheable(final_state):
+                await answer_cache.store(query, input_state["chat_history"], response)
             return response
 
-        return "I couldn't generate a response. Please try again."
\ No newline at end of file
+        return "I couldn't generate a response. Please try again."
+
+    async def generate_stream(self, user_id: str, chat_id: str, query: str, max_retries=3):
+        """
+        Runs the graph for a chat turn and yields (event, data) tuples as it progresses.
+        Progress events are emitted as nodes finish, and the answer is streamed token
+        by token from the generate nodes. A "reset" event means the tokens sent so far
+        are dropped and a new answer follows, either because the graders rejected the
+        generation or because a hedged provider call answered first.
+        """
+        chat_id, input_state = await self.start_turn(user_id, chat_id, query, max_retries)
+
+        cached = await answer_cache.lookup(query, input_state["chat_history"])
+        if cached:
+            await pgdb.finish_turn(chat_id, cached)
+            yield "route", {"route": "cache"}
+            yield "token", {"content": cached}
+            yield "done", {"response": cached, "chatId": chat_id}
+            return
+
+        graph = await self.get_or_create_graph(user_id)
+
+        final_state = dict(input_state)
+        token_step = None
+        streamed = ""
+        async for mode, chunk in graph.astream(input_state, stream_mode=["updates", "messages"]):
+            if mode == "messages":
+                message, metadata = chunk
+                node = metadata.get("langgraph_node")
+                if node not in GENERATION_NODES or not isinstance(message.content, str) or not message.content:
+                    continue
+                step = metadata.get("langgraph_step")
+                if token_step is not None and step != token_step:
+                    yield "reset", {}
+                    streamed = ""
+                token_step = step
+                streamed += message.content
+                yield "token", {"content": message.content}
+                continue
+
+            for node, update in chunk.items():
+                final_state.update(update or {})
+                if node == "route":
+                    yield "route", {"route": update["route"]}
+                elif node == "retrieve":
+                    yield "retrieved", {"documents": len(update["documents"])}
+                elif node == "grade_documents":
+                    yield "graded", {"relevant": len(update["documents"]), "web_search": update["web_search"]}
+                elif node == "websearch":
+                    yield "websearch", {"documents": len(final_state.get("documents") or [])}
+
+        loop_step = self.report_loops(final_state)
+        if "generation" in final_state:
+            response = final_state["generation"].content
+            await pgdb.finish_turn(chat_id, response)
+            if self.cacheable(final_state):
+                await answer_cache.store(query, input_state["chat_history"], response)
+        else:
+            response = "I couldn't generate a response. Please try again."
+
+        # the answer may come from a hedged call whose tokens were not streamed
+        if response != streamed:
+            if streamed:
+                yield "reset", {}
+            yield "token", {"content": response}
+
+        yield "done", {"response": response, "chatId": chat_id, "loopStep": loop_step}
\ No newline at end of file
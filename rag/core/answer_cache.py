@@ -0,0 +1,84 @@
+import hashlib
+
+import numpy as np
+
+from config import Config
+from rag.cache import LRUCache
+from rag.metrics import metrics
+from rag.data_utils.vectorstore import db
+
+
+class AnswerCache:
+    """
+    Semantic cache of answers grounded in the vectorstore, looked up by question embedding similarity.
+    Answers are only shared between turns with the same chat history fingerprint,
+    and the whole cache is dropped whenever the vectorstore corpus changes.
+    """
+    def __init__(self):
+        self.entries = LRUCache(Config.ANSWER_CACHE_SIZE, Config.ANSWER_CACHE_TTL)
+        self.version = db.version
+        metrics.register_cache("answer_cache", self.entries)
+
+
+    @staticmethod
+    def fingerprint(chat_history: list) -> str:
+        """
+        Hash of the chat history before the current question
+        """
+        digest = hashlib.sha1()
+        for msg in chat_history[:-1]:
+            digest.update(f"{msg['role']}\0{msg['content']}\0".encode())
+        return digest.hexdigest()
+
+
+    async def embed(self, question: str):
+        vector = np.asarray(await db.aembed_query(question))
+        return vector / np.linalg.norm(vector)
+
+
+    def check_version(self):
+        if self.version != db.version:
+            self.entries.clear()
+            self.version = db.version
+
+
+    async def lookup(self, question: str, chat_history: list):
+        """
+        Returns
+            answer: cached answer of the most similar question above the threshold or None
+        """
+        if Config.ANSWER_CACHE_SIZE <= 0:
+            return None
+        self.check_version()
+        embedding = await self.embed(question)
+        fingerprint = self.fingerprint(chat_history)
+
+        best_key, best_score = None, Config.ANSWER_CACHE_THRESHOLD
+        for key, (entry_fingerprint, entry_embedding, _) in self.entries.items():
+            if entry_fingerprint != fingerprint:
+                continue
+            score = float(np.dot(embedding, entry_embedding))
+            if score >= best_score:
+                best_key, best_score = key, score
+
+        if best_key is None:
+            self.entries.misses += 1
+            return None
+        # counts the hit, or the miss when the entry expired or was evicted since the scan
+        entry = self.entries.get(best_key)
+        if entry is None:
+            return None
+        print(f"---ANSWER CACHE HIT ({best_score:.3f})---")
+        return entry[2]
+
+
+    async def store(self, question: str, chat_history: list, answer: str):
+        if Config.ANSWER_CACHE_SIZE <= 0:
+            return
+        self.check_version()
+        fingerprint = self.fingerprint(chat_history)
+        embedding = await self.embed(question)
+        self.entries.set((fingerprint, db.normalize_query(question)), (fingerprint, embedding, answer))
+
+
+answer_cache = AnswerCache()
@@ -0,0 +1,68 @@
+import json
+import asyncio
+import hashlib
+
+from config import Config
+from rag.cache import LRUCache
+from rag.metrics import metrics
+
+
+class CoalescingLLM:
+    """
+    Wraps a provider group so identical concurrent calls share one request. Results
+    answered by a deterministic (temperature 0) member are also kept for
+    Config.LLM_CACHE_TTL seconds. Callers sharing a request get its result but not
+    its streamed tokens, callbacks only report to the caller that sent it.
+    Anything other than ainvoke is passed through to the model.
+    """
+    def __init__(self, model, name: str):
+        self.model = model
+        self.name = name
+        self.deterministic = any(member.deterministic for member in model.members)
+        self.inflight = {}
+        self.results = LRUCache(Config.LLM_CACHE_SIZE if self.deterministic else 0, Config.LLM_CACHE_TTL)
+        metrics.register_cache(f"llm.{name}", self.results)
+
+
+    def key(self, messages, kwargs: dict) -> str:
+        if isinstance(messages, str):
+            messages = [("human", messages)]
+        else:
+            messages = [(m.type, m.content) for m in messages]
+        payload = json.dumps([self.name, messages, kwargs], sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+
+    async def ainvoke(self, messages, config=None, **kwargs):
+        key = self.key(messages, kwargs)
+        metrics.incr(f"llm.{self.name}.calls")
+
+        if self.deterministic:
+            result = self.results.get(key)
+            if result is not None:
+                metrics.incr(f"llm.{self.name}.cache_hits")
+                return result
+
+        task = self.inflight.get(key)
+        if task is not None:
+            metrics.incr(f"llm.{self.name}.coalesced")
+        else:
+            # a task of its own, so a cancelled caller does not cancel the others
+            task = asyncio.ensure_future(self.model.ainvoke_with_member(messages, config, **kwargs))
+            self.inflight[key] = task
+            task.add_done_callback(lambda t: self.done(key, t))
+        result, _ = await asyncio.shield(task)
+        return result
+
+
+    def done(self, key: str, task: asyncio.Task):
+        self.inflight.pop(key, None)
+        if self.deterministic and not task.cancelled() and task.exception() is None:
+            result, member = task.result()
+            # the group may have answered from a sampling provider
+            if member.deterministic:
+                self.results.set(key, result)
+
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
@@ -0,0 +1,117 @@
+import re
+import asyncio
+import hashlib
+
+import numpy as np
+
+from config import Config
+from rag.cache import LRUCache
+from rag.metrics import metrics
+from rag.data_utils.vectorstore import db
+from rag.utils import count_tokens, format_doc_text
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+# passage text hash -> normalized embedding, the same chunks come back across questions
+passage_embeddings = LRUCache(Config.PASSAGE_CACHE_SIZE)
+metrics.register_cache("passage_embeddings", passage_embeddings)
+
+
+def split_passages(text: str) -> list:
+    """
+    Splits a chunk into paragraphs, long paragraphs into groups of sentences
+    of at most Config.CONTEXT_PASSAGE_TOKENS tokens
+    Returns
+        passages: list of (text, tokens)
+    """
+    passages = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        tokens = count_tokens(paragraph)
+        if tokens <= Config.CONTEXT_PASSAGE_TOKENS:
+            passages.append((paragraph, tokens))
+            continue
+        group, group_tokens = [], 0
+        for sentence in SENTENCE_END.split(paragraph):
+            sentence_tokens = count_tokens(sentence)
+            if group and group_tokens + sentence_tokens > Config.CONTEXT_PASSAGE_TOKENS:
+                passages.append((" ".join(group), group_tokens))
+                group, group_tokens = [], 0
+            group.append(sentence)
+            group_tokens += sentence_tokens
+        if group:
+            passages.append((" ".join(group), group_tokens))
+    return passages
+
+
+def embed_passages(texts: list) -> list:
+    keys = [hashlib.sha1(text.encode()).hexdigest() for text in texts]
+    embeddings = [passage_embeddings.get(key) for key in keys]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+        vectors = db.embeddings.embed_documents([texts[i] for i in missing])
+        for i, vector in zip(missing, vectors):
+            vector = np.asarray(vector, dtype=float)
+            embeddings[i] = vector / np.linalg.norm(vector)
+            passage_embeddings.set(keys[i], embeddings[i])
+    return embeddings
+
+
+def compress(question: str, documents: list) -> str:
+    """
+    Packs the passages of the documents most similar to the question into
+    Config.CONTEXT_TOKEN_BUDGET tokens, keeping their order within each document
+    Returns
+        context: text of the kept passages
+    """
+    budget = Config.CONTEXT_TOKEN_BUDGET
+    if budget <= 0:
+        return format_doc_text(documents)
+
+    # positions[n] is passage n's index within its document
+    passages, positions = [], []
+    for i, d in enumerate(documents):
+        for position, (text, tokens) in enumerate(split_passages(d.page_content)):
+            passages.append((i, text, tokens))
+            positions.append(position)
+    total = sum(tokens for _, _, tokens in passages)
+    metrics.incr("context.tokens_in", total)
+    if total <= budget:
+        return format_doc_text(documents)
+
+    query = np.asarray(db.embed_query(question), dtype=float)
+    query = query / np.linalg.norm(query)
+    # the cap is taken round-robin, each document's leading passages first, so every
+    # document gets scored ones; the rest are not embedded and rank below in document order
+    scored = sorted(range(len(passages)), key=lambda n: (positions[n], n))[:Config.CONTEXT_MAX_PASSAGES]
+    with metrics.timer("context.embed"):
+        embeddings = embed_passages([passages[n][1] for n in scored])
+    scores = [-1.0 - n for n in range(len(passages))]
+    for index, embedding in zip(scored, embeddings):
+        scores[index] = float(np.dot(query, embedding))
+
+    kept, used = set(), 0
+    for index in sorted(range(len(passages)), key=lambda n: scores[n], reverse=True):
+        tokens = passages[index][2]
+        if used + tokens <= budget:
+            kept.add(index)
+            used += tokens
+
+    doc_texts = {}
+    for index in sorted(kept):
+        i, text, _ = passages[index]
+        doc_texts.setdefault(i, []).append(text)
+
+    saved = total - used
+    metrics.incr("context.tokens_saved", saved)
+    print(f"---CONTEXT: {used} OF {total} TOKENS KEPT, {saved} SAVED---")
+    # same separators as the uncompressed context
+    return "\n\n".join("\n\n".join(doc_texts[i]) for i in sorted(doc_texts))
+
+
+async def build_context(question: str, documents: list) -> str:
+    # tokenizing and embedding are CPU bound, keep them off the event loop
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, compress, question, documents)
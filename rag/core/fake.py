@@ -0,0 +1,44 @@
+import json
+import random
+import asyncio
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from config import Config
+
+
+class FakeRateLimitError(Exception):
+    status_code = 429
+
+
+class FakeChatModel:
+    """
+    Offline stand-in for a chat model with configurable latency and rate limiting,
+    used to load test the limiter and the graph without calling a provider
+    """
+    def __init__(self, json_mode: bool = False, latency: float = None, error_rate: float = None):
+        self.json_mode = json_mode
+        self.latency = Config.FAKE_LLM_LATENCY if latency is None else latency
+        self.error_rate = Config.FAKE_LLM_ERROR_RATE if error_rate is None else error_rate
+
+
+    def respond(self) -> str:
+        if self.json_mode:
+            return json.dumps({
+                "datasource": "vectorstore", "binary_score": "yes",
+                "grounded": "yes", "useful": "yes", "scores": {}, "explanation": "fake",
+            })
+        return "This is a fake answer."
+
+
+    async def ainvoke(self, messages, config=None, **kwargs):
+        await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+        if random.random() < self.error_rate:
+            raise FakeRateLimitError("429 rate limit exceeded")
+        return AIMessage(content=self.respond())
+
+
+    async def astream(self, messages, config=None, **kwargs):
+        message = await self.ainvoke(messages, config, **kwargs)
+        for word in message.content.split(" "):
+            yield AIMessageChunk(content=word + " ")
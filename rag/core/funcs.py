@@ -1,16 +1,35 @@
 import json
+import time
+import hashlib
+import asyncio
 
 from langchain.schema import Document
 from langchain_core.messages import HumanMessage, SystemMessage
 
-from rag.utils import format_doc_text
+from rag.utils import format_doc_text, format_chat_history
 from rag.data_utils.vectorstore import db
 from rag.core.prompts import Prompts
-from rag.core.web import web_search_tool
+from rag.core.web import web_search_tool, query_rewrites, normalize_query
+from rag.core.rerank import reranker
+from rag.core.router import router
+from rag.core.context import build_context
 
 from rag import llm
+from rag.metrics import metrics
+from config import Config
+from rag.cache import LRUCache
 
-def retrieve(state):
+# (facts, question, generation) hash -> (grounded, useful), retries often regrade the same pair
+grade_verdicts = LRUCache(Config.GRADE_CACHE_SIZE)
+metrics.register_cache("grade_verdicts", grade_verdicts)
+
+def retrieval_k():
+    """
+    Number of documents to retrieve, the reranker over-fetches and keeps the best
+    """
+    return Config.RERANK_FETCH_K if Config.DOC_GRADING_MODE == "rerank" else 4
+
+async def retrieve(state):
     """
     Retrieve documents from vectorstore
     Args:
@@ -21,10 +40,26 @@ def retrieve(state):
     print("---RETRIEVE---")
     question = state["question"]
 
-    documents = db.search(question)
+    # already retrieved speculatively while routing
+    documents = state.get("documents")
+    if documents is None:
+        documents = await db.asearch(question, retrieval_k())
     return {"documents": documents}
 
-def generate(state):
+def format_history(state):
+    """
+    Returns the rolling summary and recent chat messages as prompt text
+    """
+    history_text = ""
+    summary = state.get("history_summary")
+    chat_history = state.get("chat_history", [])
+    if summary:
+        history_text += f"Summary of earlier conversation:\n{summary}\n\n"
+    if chat_history:
+        history_text += f"Chat History:\n{format_chat_history(chat_history)}\n"
+    return history_text
+
+async def generate(state):
     """
     Generate answer using RAG on retrieved documents, incorporating chat history
     Args:
@@ -36,18 +71,11 @@ def generate(state):
     question = state["question"]
     documents = state["documents"]
     loop_step = state.get("loop_step", 0)
-    chat_history = state.get("chat_history", [])
 
     # Format chat history for context
-    history_text = ""
-    if chat_history:
-        history_text = "Chat History:\n"
-        for msg in chat_history:
-            prefix = "Human: " if msg["role"] == "human" else "Assistant: "
-            history_text += f"{prefix}{msg['content']}\n"
-        history_text += "\n"
+    history_text = format_history(state)
 
-    docs_txt = format_doc_text(documents)
+    docs_txt = await build_context(question, documents)
 
     rag_prompt_formatted = Prompts.RAG_PROMPT.format(
         context=docs_txt, 
@@ -55,19 +83,16 @@ def generate(state):
         chat_history=history_text
     )
     
-    generation = llm.core_llm.invoke([HumanMessage(content=rag_prompt_formatted)])
-    
-    new_chat_history = chat_history.copy()
-    new_chat_history.append({"role": "human", "content": question})
-    new_chat_history.append({"role": "assistant", "content": generation.content})
+    generation = await llm.core_llm.ainvoke([HumanMessage(content=rag_prompt_formatted)])
     
+    # chat_history is left as loaded, so retries don't feed earlier attempts back into the prompt
     return {
         "generation": generation, 
+        "context": docs_txt,
         "loop_step": loop_step + 1,
-        "chat_history": new_chat_history
     }
 
-def simple_generate(state):
+async def simple_generate(state):
     """
     Generate answer using LLM incorporating chat history
     Args:
@@ -78,32 +103,70 @@ def simple_generate(state):
     print("---GENERATE---")
     question = state["question"]
     loop_step = state.get("loop_step", 0)
-    chat_history = state.get("chat_history", [])
 
-    history_text = ""
-    if chat_history:
-        history_text = "Chat History:\n"
-        for msg in chat_history:
-            prefix = "Human: " if msg["role"] == "human" else "Assistant: "
-            history_text += f"{prefix}{msg['content']}\n"
-        history_text += "\n"
+    history_text = format_history(state)
 
-    generation = llm.core_llm.invoke([HumanMessage(content=Prompts.SIMPLE_PROMPT.format(
+    generation = await llm.core_llm.ainvoke([HumanMessage(content=Prompts.SIMPLE_PROMPT.format(
         question=question,
-        chat_history=chat_history
+        chat_history=history_text
     ))])
     
-    new_chat_history = chat_history.copy()
-    new_chat_history.append({"role": "human", "content": question})
-    new_chat_history.append({"role": "assistant", "content": generation.content})
-    
     return {
         "generation": generation, 
         "loop_step": loop_step + 1,
-        "chat_history": new_chat_history
     }
 
-def grade_documents(state):
+async def grade_document(document, question):
+    """
+    Grades a single document against the question
+    Returns:
+        bool: Whether the document is relevant
+    """
+    doc_grader_prompt_formatted = Prompts.DOC_GRADER_PROMPT.format(
+        document=document.page_content, question=question
+    )
+    result = await llm.json_llm.ainvoke(
+        [SystemMessage(content=Prompts.DOC_GRADER_INSTRUCTIONS)]
+        + [HumanMessage(content=doc_grader_prompt_formatted)]
+    )
+    grade = json.loads(result.content)["binary_score"]
+    return grade.lower() == "yes"
+
+async def grade_documents_concurrent(documents, question):
+    """
+    Grades every document with its own llm call, at most
+    Config.DOC_GRADING_CONCURRENCY calls at a time
+    Returns:
+        list: Relevance of each document
+    """
+    semaphore = asyncio.Semaphore(max(1, Config.DOC_GRADING_CONCURRENCY))
+
+    async def grade(document):
+        async with semaphore:
+            return await grade_document(document, question)
+
+    return await asyncio.gather(*[grade(d) for d in documents])
+
+async def grade_documents_batch(documents, question):
+    """
+    Grades all documents in a single llm call
+    Returns:
+        list: Relevance of each document, documents without a score are not relevant
+    """
+    docs_txt = "\n\n".join(
+        f"<document id=\"{i}\">\n{d.page_content}\n</document>" for i, d in enumerate(documents)
+    )
+    doc_grader_prompt_formatted = Prompts.DOC_BATCH_GRADER_PROMPT.format(
+        documents=docs_txt, question=question
+    )
+    result = await llm.json_llm.ainvoke(
+        [SystemMessage(content=Prompts.DOC_GRADER_INSTRUCTIONS)]
+        + [HumanMessage(content=doc_grader_prompt_formatted)]
+    )
+    scores = json.loads(result.content)["scores"]
+    return [str(scores.get(str(i), "no")).lower() == "yes" for i in range(len(documents))]
+
+async def grade_documents(state):
     """
     Determines whether the retrieved documents are relevant to the question
     If any document is not relevant, we will set a flag to run web search
@@ -126,19 +189,19 @@ def grade_documents(state):
         recent_context_parts.append(question)
         recent_context = " ".join(recent_context_parts)
 
+    mode = Config.DOC_GRADING_MODE
+    with metrics.timer(f"grade_documents.{mode}"):
+        if not documents:
+            grades = []
+        elif mode == "batch":
+            grades = await grade_documents_batch(documents, recent_context)
+        else:
+            grades = await grade_documents_concurrent(documents, recent_context)
+
     filtered_docs = []
     web_search = "No"
-    for d in documents:
-        doc_grader_prompt_formatted = Prompts.DOC_GRADER_PROMPT.format(
-            document=d.page_content, question=recent_context
-        )
-        result = llm.json_llm.invoke(
-            [SystemMessage(content=Prompts.DOC_GRADER_INSTRUCTIONS)]
-            + [HumanMessage(content=doc_grader_prompt_formatted)]
-        )
-        grade = json.loads(result.content)["binary_score"]
-
-        if grade.lower() == "yes":
+    for d, relevant in zip(documents, grades):
+        if relevant:
             print("---GRADE: DOCUMENT RELEVANT---")
             filtered_docs.append(d)
         else:
@@ -147,7 +210,59 @@ def grade_documents(state):
             continue
     return {"documents": filtered_docs, "web_search": web_search}
 
-def web_search(state):
+async def rerank_documents(state):
+    """
+    Scores the retrieved documents with the local cross-encoder, a drop-in for grade_documents
+    Keeps the best Config.RERANK_TOP_N documents above Config.RERANK_THRESHOLD and sets the flag
+    to run web search when fewer than Config.RERANK_MIN_DOCS are kept
+    Args:
+        state (dict): The current graph state
+    Returns:
+        state (dict): Filtered out irrelevant documents and updated web_search state
+    """
+    print("---RERANK DOCUMENTS---")
+    question = state["question"]
+    documents = state["documents"]
+    chat_history = state.get("chat_history", [])
+
+    # follow-ups are scored with the recent human messages they refer to,
+    # only those so the pairs stay within the cross-encoder's input length
+    rerank_query = question
+    # the history ends with the question itself
+    last_human_messages = [msg["content"] for msg in chat_history[-4:] if msg["role"] == "human" and msg["content"] != question]
+    if last_human_messages:
+        rerank_query = " ".join(last_human_messages + [question])
+
+    with metrics.timer("grade_documents.rerank"):
+        scores = await reranker.ascore(rerank_query, [d.page_content for d in documents])
+
+    ranked = sorted(zip(scores, documents), key=lambda item: item[0], reverse=True)
+    filtered_docs = [d for score, d in ranked[:Config.RERANK_TOP_N] if score >= Config.RERANK_THRESHOLD]
+    print(f"---RERANK: {len(filtered_docs)} OF {len(documents)} DOCUMENTS RELEVANT---")
+
+    web_search = "Yes" if len(filtered_docs) < Config.RERANK_MIN_DOCS else "No"
+    return {"documents": filtered_docs, "web_search": web_search}
+
+def merge_documents(documents, new_documents):
+    """
+    Appends the new documents that are not already present by content hash and
+    keeps at most Config.MAX_CONTEXT_DOCS documents, the graded vectorstore
+    documents first and then the web results, newest first
+    Returns:
+        list: merged documents
+    """
+    merged = list(documents)
+    seen = {hashlib.sha1(d.page_content.encode()).hexdigest() for d in merged}
+    for d in new_documents:
+        digest = hashlib.sha1(d.page_content.encode()).hexdigest()
+        if digest not in seen:
+            seen.add(digest)
+            merged.append(d)
+    notes = [d for d in merged if d.metadata.get("source") != "web"]
+    web = [d for d in merged if d.metadata.get("source") == "web"]
+    return (notes + web[::-1])[:Config.MAX_CONTEXT_DOCS]
+
+async def web_search(state):
     """
     Web search based on the question and possibly chat history context
     Args:
@@ -157,32 +272,77 @@ def web_search(state):
     """
     print("---WEB SEARCH---")
     question = state["question"]
-    documents = state.get("documents", [])
+    documents = state.get("documents") or []
     chat_history = state.get("chat_history", [])
 
     search_query = question
     if chat_history:
         last_human_messages = [msg for msg in chat_history[-4:] if msg["role"] == "human"]
         if last_human_messages:
-            # Use LLM to create a better search query based on conversation context
             search_context = "\n".join([msg["content"] for msg in last_human_messages])
-            search_query_prompt = f"Based on this conversation context:\n{search_context}\n\nAnd this latest question:\n{question}\n\nFormulate the best search query to find relevant information. Give only the query (must):"
-            search_query_result = llm.core_llm.invoke([HumanMessage(content=search_query_prompt)])
-            search_query = search_query_result.content
-
-    docs = web_search_tool.invoke({"query": search_query})
-    web_results = "\n".join([d["content"] for d in docs['results']])
-    web_results = Document(page_content=web_results)
-    documents.append(web_results)
-    return {"documents": documents}
+            rewrite_key = (search_context, question)
+            search_query = query_rewrites.get(rewrite_key)
+            if search_query is None:
+                # Use LLM to create a better search query based on conversation context
+                search_query_prompt = f"Based on this conversation context:\n{search_context}\n\nAnd this latest question:\n{question}\n\nFormulate the best search query to find relevant information. Give only the query (must):"
+                search_query_result = await llm.core_llm.ainvoke([HumanMessage(content=search_query_prompt)])
+                search_query = search_query_result.content
+                query_rewrites.set(rewrite_key, search_query)
 
-def route_question(state):
+    fetched_sources = state.get("fetched_sources") or []
+    source = normalize_query(search_query)
+    if source in fetched_sources:
+        # nothing new to generate from, the turn ends with the last generation
+        print("---WEB SEARCH: ALREADY FETCHED---")
+        return {"search_exhausted": True}
+
+    results = await web_search_tool.asearch(search_query)
+    web_results = "\n".join(results)
+    web_results = Document(page_content=web_results, metadata={"source": "web"})
+    return {
+        "documents": merge_documents(documents, [web_results]),
+        "fetched_sources": fetched_sources + [source],
+    }
+
+def routes_locally(chat_history):
+    # chat_history ends with the current question, anything before it makes this a follow-up
+    return Config.ROUTER_MODE == "embedding" and len(chat_history or []) <= 1
+
+async def choose_route(question, routing_context, chat_history=None):
+    """
+    Returns:
+        str: datasource chosen by the local router, or by the llm router when unsure
+        or when the question follows up on the chat history the local router can't see
+    """
+    source = None
+    if routes_locally(chat_history):
+        source = await router.aroute(question)
+
+    if source:
+        metrics.incr(f"router.local.{source}")
+    else:
+        route_question = await llm.json_llm.ainvoke(
+            [SystemMessage(content=Prompts.ROUTER_INSTRUCTIONS)]
+            + [HumanMessage(content=routing_context)]
+        )
+        source = json.loads(route_question.content)["datasource"]
+        metrics.incr(f"router.llm.{source}")
+    return source
+
+async def timed_search(question):
+    start = time.perf_counter()
+    documents = await db.asearch(question, retrieval_k())
+    return documents, time.perf_counter() - start
+
+async def route_question(state):
     """
     Route question to web search or RAG, considering chat history
+    With Config.SPECULATIVE_RETRIEVAL the vectorstore search runs while routing,
+    its documents are kept for the vectorstore route and dropped otherwise
     Args:
         state (dict): The current graph state
     Returns:
-        str: Next node to call
+        state (dict): route taken, with the retrieved documents when speculation was used
     """
     print("---ROUTE QUESTION---")
     question = state["question"]
@@ -193,22 +353,70 @@ def route_question(state):
         recent_messages = chat_history[-4:] if len(chat_history) > 4 else chat_history
         history_context = "\n".join([f"{'Human' if msg['role'] == 'human' else 'Assistant'}: {msg['content']}" for msg in recent_messages])
         routing_context = f"Chat history:\n{history_context}\n\nCurrent question: {question}"
-    
-    route_question = llm.json_llm.invoke(
-        [SystemMessage(content=Prompts.ROUTER_INSTRUCTIONS)]
-        + [HumanMessage(content=routing_context)]
-    )
-    source = json.loads(route_question.content)["datasource"]
-    
+
+    search_task = None
+    if Config.SPECULATIVE_RETRIEVAL:
+        # both the local router and the search need the query embedding, compute it once
+        if routes_locally(chat_history):
+            await db.aembed_query(question)
+        search_task = asyncio.create_task(timed_search(question))
+
+    start = time.perf_counter()
+    try:
+        source = await choose_route(question, routing_context, chat_history)
+    except BaseException:
+        if search_task:
+            search_task.cancel()
+        raise
+    route_seconds = time.perf_counter() - start
+
+    update = {"route": source}
+    if search_task and source == "vectorstore":
+        try:
+            update["documents"], search_seconds = await search_task
+        except Exception as e:
+            # retrieve searches again
+            print(f"---SPECULATIVE RETRIEVAL FAILED : {e}---")
+        else:
+            saved = min(route_seconds, search_seconds)
+            metrics.incr("speculation.used")
+            metrics.observe("speculation.saved", saved)
+            print(f"---SPECULATIVE RETRIEVAL USED, SAVED {saved:.3f}s---")
+    elif search_task:
+        if search_task.done() and not search_task.cancelled() and not search_task.exception():
+            wasted = search_task.result()[1]
+        else:
+            # the executor thread finishes the search anyway, count what ran so far
+            wasted = time.perf_counter() - start
+            search_task.cancel()
+        metrics.incr("speculation.wasted")
+        metrics.observe("speculation.wasted", wasted)
+        print(f"---SPECULATIVE RETRIEVAL DISCARDED, WASTED {wasted:.3f}s---")
+
     if source == "websearch":
         print("---ROUTE QUESTION TO WEB SEARCH---")
-        return "websearch"
     elif source == "vectorstore":
         print("---ROUTE QUESTION TO RAG---")
-        return "vectorstore"
     elif source == "generate":
         print("---ROUTE QUESTION TO LLM---")
-        return "generate"
+    return update
+
+def decide_route(state):
+    """
+    Returns:
+        str: Next node to call for the route taken by route_question
+    """
+    return state["route"]
+
+def decide_after_web_search(state):
+    """
+    Returns:
+        str: "generate", or "exhausted" when the search brought nothing new after a generation
+    """
+    if state.get("search_exhausted") and state.get("generation") is not None:
+        print("---DECISION: NO NEW WEB RESULTS, KEEP LAST GENERATION---")
+        return "exhausted"
+    return "generate"
 
 def decide_to_generate(state):
     """
@@ -230,7 +438,84 @@ def decide_to_generate(state):
         print("---DECISION: GENERATE---")
         return "generate"
 
-def grade_generation_v_documents_and_question(state):
+def accept_generation(state):
+    """
+    Marks the generation as grounded and useful
+    Args:
+        state (dict): The current graph state
+    Returns:
+        state (dict): grounded flag set on the state
+    """
+    return {"grounded": True}
+
+async def grade_hallucination(facts, generation):
+    """
+    Returns:
+        bool: Whether the generation is grounded in the facts
+    """
+    hallucination_grader_prompt_formatted = Prompts.HALLUCINATION_GRADER_PROMPT.format(
+        documents=facts, generation=generation.content
+    )
+    result = await llm.json_llm.ainvoke(
+        [SystemMessage(content=Prompts.HALLUCINATION_GRADER_INSTRUCT)]
+        + [HumanMessage(content=hallucination_grader_prompt_formatted)]
+    )
+    return json.loads(result.content)["binary_score"] == "yes"
+
+async def grade_answer(question, generation):
+    """
+    Returns:
+        bool: Whether the generation addresses the question
+    """
+    answer_grader_prompt_formatted = Prompts.ANSWER_GRADER_PROMPT.format(
+        question=question, generation=generation.content
+    )
+    result = await llm.json_llm.ainvoke(
+        [SystemMessage(content=Prompts.ANSWER_GRADER_INSTRUCT)]
+        + [HumanMessage(content=answer_grader_prompt_formatted)]
+    )
+    return json.loads(result.content)["binary_score"] == "yes"
+
+async def grade_generation(facts, question, generation):
+    """
+    Runs the hallucination and answer graders as set by Config.GENERATION_GRADING_MODE
+    'sequential' grades the answer only after grounding passed, 'parallel' runs both
+    graders at once and drops the answer grade when grounding fails, 'combined' asks
+    for both scores in a single llm call
+    Returns:
+        tuple: grounded, useful (None when the answer was not graded)
+    """
+    mode = Config.GENERATION_GRADING_MODE
+    with metrics.timer(f"grade_generation.{mode}"):
+        if mode == "combined":
+            grader_prompt_formatted = Prompts.GENERATION_GRADER_PROMPT.format(
+                documents=facts, question=question, generation=generation.content
+            )
+            result = await llm.json_llm.ainvoke(
+                [SystemMessage(content=Prompts.GENERATION_GRADER_INSTRUCT)]
+                + [HumanMessage(content=grader_prompt_formatted)]
+            )
+            grade = json.loads(result.content)
+            grounded = grade["grounded"] == "yes"
+            return grounded, grounded and grade["useful"] == "yes"
+
+        if mode == "parallel":
+            answer_task = asyncio.create_task(grade_answer(question, generation))
+            try:
+                grounded = await grade_hallucination(facts, generation)
+            except BaseException:
+                answer_task.cancel()
+                raise
+            if not grounded:
+                answer_task.cancel()
+                return False, None
+            return True, await answer_task
+
+        if not await grade_hallucination(facts, generation):
+            return False, None
+        return True, await grade_answer(question, generation)
+
+async def grade_generation_v_documents_and_question(state):
     """
     Determines whether the generation is grounded in the document and answers question
     Args:
@@ -252,27 +537,19 @@ def grade_generation_v_documents_and_question(state):
         context_text = "\n".join([f"{'Human' if msg['role'] == 'human' else 'Assistant'}: {msg['content']}" for msg in recent_context])
         grading_context = f"Chat context:\n{context_text}\n\nQuestion: {question}"
 
-    hallucination_grader_prompt_formatted = Prompts.HALLUCINATION_GRADER_PROMPT.format(
-        documents=format_doc_text(documents), generation=generation.content
-    )
-    result = llm.json_llm.invoke(
-        [SystemMessage(content=Prompts.HALLUCINATION_GRADER_INSTRUCT)]
-        + [HumanMessage(content=hallucination_grader_prompt_formatted)]
-    )
-    grade = json.loads(result.content)["binary_score"]
+    # grade against the same compressed context the generation was given
+    facts = state.get("context") or format_doc_text(documents)
+    verdict_key = hashlib.sha1("\0".join([facts, grading_context, generation.content]).encode()).hexdigest()
+    verdict = grade_verdicts.get(verdict_key)
+    if verdict is None:
+        verdict = await grade_generation(facts, grading_context, generation)
+        grade_verdicts.set(verdict_key, verdict)
+    grounded, useful = verdict
 
-    if grade == "yes":
+    if grounded:
         print("---DECISION: GENERATION IS GROUNDED IN DOCUMENTS---")
         print("---GRADE GENERATION vs QUESTION---")
-        answer_grader_prompt_formatted = Prompts.ANSWER_GRADER_PROMPT.format(
-            question=grading_context, generation=generation.content
-        )
-        result = llm.json_llm.invoke(
-            [SystemMessage(content=Prompts.ANSWER_GRADER_INSTRUCT)]
-            + [HumanMessage(content=answer_grader_prompt_formatted)]
-        )
-        grade = json.loads(result.content)["binary_score"]
-        if grade == "yes":
+        if useful:
             print("---DECISION: GENERATION ADDRESSES QUESTION---")
             return "useful"
         elif loop_step <= max_retries:
@@ -0,0 +1,81 @@
+import asyncio
+
+from langchain_core.messages import HumanMessage
+
+from config import Config
+from rag import llm
+from rag.core.prompts import Prompts
+from rag.core.limiter import llm_priority, BACKGROUND
+from rag.data_utils.pg_db import pgdb
+from rag.utils import count_tokens, format_chat_history
+
+
+class HistoryManager:
+    """
+    Keeps the most recent messages of a chat verbatim within a token budget and folds
+    the older ones into a rolling summary stored in Postgres. Summaries are refreshed
+    in the background, until then up to Config.HISTORY_SUMMARY_BATCH messages that left
+    the window are still sent verbatim.
+    """
+    def __init__(self):
+        self.tasks = {}  # chat_id -> running summary refresh
+
+
+    def window_start(self, messages: list) -> int:
+        """
+        Returns
+            index of the oldest message kept verbatim, the newest message is always kept
+        """
+        start, tokens = len(messages), 0
+        while start > 0 and len(messages) - start < Config.HISTORY_MAX_MESSAGES:
+            tokens += count_tokens(messages[start - 1]["content"])
+            if tokens > Config.HISTORY_TOKEN_BUDGET and start < len(messages):
+                break
+            start -= 1
+        return start
+
+
+    async def load(self, chat_id: str, messages: list, stored: tuple = None):
+        """
+        Args:
+            stored: (summary, covered) already read with the messages, fetched when not given
+        Returns
+            summary: summary of the messages before the window or None, recent: messages kept verbatim
+        """
+        summary, covered = stored or await pgdb.get_chat_summary(chat_id)
+        # tokenizing is cpu bound, kept off the event loop
+        start = await asyncio.to_thread(self.window_start, messages)
+        if start > covered:
+            self.schedule(chat_id, messages[:start])
+        # messages past the summary stay verbatim until the refresh folds them in, capped
+        # so the prompt stays bounded while a summary is pending or failing
+        return summary, messages[max(covered, start - Config.HISTORY_SUMMARY_BATCH):]
+
+
+    def schedule(self, chat_id: str, older: list):
+        if chat_id in self.tasks:
+            return
+        # summaries yield to chat calls waiting on the same provider
+        with llm_priority(BACKGROUND):
+            task = asyncio.create_task(self.refresh(chat_id, older))
+        self.tasks[chat_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(chat_id, None))
+
+
+    async def refresh(self, chat_id: str, older: list):
+        """
+        Folds the messages not yet in the summary into it, a batch of messages per llm call
+        """
+        try:
+            summary, covered = await pgdb.get_chat_summary(chat_id)
+            while covered < len(older):
+                batch = older[covered:covered + Config.HISTORY_SUMMARY_BATCH]
+                prompt = Prompts.SUMMARY_PROMPT.format(summary=summary or "None", messages=format_chat_history(batch))
+                result = await llm.core_llm.ainvoke([HumanMessage(content=prompt)])
+                summary, covered = result.content, covered + len(batch)
+                await pgdb.save_chat_summary(chat_id, summary, covered)
+        except Exception as e:
+            print(f"Failed to summarize chat {chat_id} : {e}")
+
+
+history = HistoryManager()
@@ -0,0 +1,227 @@
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import contextvars
+
+from contextlib import contextmanager
+
+from config import Config
+from rag.metrics import metrics
+
+# llm call priorities, lower is served first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+priority = contextvars.ContextVar("llm_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def llm_priority(value: int):
+    """
+    Sets the priority of the llm calls made inside the block
+    """
+    token = priority.set(value)
+    try:
+        yield
+    finally:
+        priority.reset(token)
+
+
+class QueueFullError(Exception):
+    """
+    Raised when the provider queue is full and the call is shed
+    """
+
+
+def status_code(error: Exception):
+    for source in (error, getattr(error, 'response', None)):
+        code = getattr(source, 'status_code', None) or getattr(source, 'code', None)
+        if isinstance(code, int):
+            return code
+    return None
+
+
+def is_throttled(error: Exception) -> bool:
+    message = str(error).lower()
+    return status_code(error) == 429 or "rate limit" in message or "resource exhausted" in message or "429" in message
+
+
+def is_retryable(error: Exception) -> bool:
+    code = status_code(error)
+    name = type(error).__name__
+    return is_throttled(error) or (code is not None and code >= 500) \
+        or "Timeout" in name or "Connection" in name or isinstance(error, asyncio.TimeoutError)
+
+
+class ProviderLimiter:
+    """
+    Token bucket rate limit and adaptive concurrency cap for one llm provider.
+    Callers over the cap wait in a bounded priority queue. The cap grows while
+    calls succeed under the target latency and is cut on errors and throttling.
+    """
+    def __init__(self, name: str, rate: float, burst: int, max_concurrency: int, max_queue: int, target_latency: float):
+        self.name = name
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+        self.max_limit = max(1, max_concurrency)
+        self.limit = float(self.max_limit)
+        self.active = 0
+        self.max_queue = max_queue
+        self.target_latency = target_latency
+
+        self.waiters = []  # heap of (priority, sequence, future)
+        self.sequence = itertools.count()
+
+
+    async def acquire(self):
+        # the rate token comes first, so a throttled caller never sits on a slot
+        await self.take_token()
+
+        if self.active < int(self.limit) and not self.waiters:
+            self.active += 1
+            return
+
+        self.waiters = [w for w in self.waiters if not w[2].done()]
+        heapq.heapify(self.waiters)
+        if len(self.waiters) >= self.max_queue:
+            metrics.incr(f"limiter.{self.name}.shed")
+            raise QueueFullError(f"{self.name} queue is full")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority.get(), next(self.sequence), future))
+        metrics.set(f"limiter.{self.name}.queue_depth", len(self.waiters))
+        start = time.perf_counter()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # the slot was handed over as we got cancelled
+                self.release()
+            raise
+        metrics.observe(f"limiter.{self.name}.queue_wait", time.perf_counter() - start)
+
+
+    async def take_token(self):
+        if self.rate <= 0:
+            return
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+    def release(self):
+        self.active -= 1
+        self.wake()
+
+
+    def wake(self):
+        while self.waiters and self.active < int(self.limit):
+            _, _, future = heapq.heappop(self.waiters)
+            if future.done():
+                continue
+            self.active += 1
+            future.set_result(None)
+        metrics.set(f"limiter.{self.name}.queue_depth", len(self.waiters))
+
+
+    def record(self, latency: float, error: bool = False, throttled: bool = False):
+        """
+        Adapts the concurrency cap to the outcome of a call
+        """
+        if throttled or error:
+            self.limit = max(1.0, self.limit / 2)
+        elif latency > self.target_latency:
+            self.limit = max(1.0, self.limit * 0.9)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        metrics.set(f"limiter.{self.name}.concurrency_limit", round(self.limit, 2))
+        metrics.observe(f"limiter.{self.name}.latency", latency)
+        if throttled:
+            metrics.incr(f"limiter.{self.name}.throttled")
+        elif error:
+            metrics.incr(f"limiter.{self.name}.errors")
+        self.wake()
+
+
+limiters = {}
+
+
+def get_limiter(provider: str) -> ProviderLimiter:
+    """
+    Returns the limiter shared by every client of the provider
+    """
+    if provider not in limiters:
+        limiters[provider] = ProviderLimiter(
+            provider,
+            rate=Config.LLM_RATE_LIMITS.get(provider, Config.LLM_RATE_LIMIT),
+            burst=Config.LLM_BURST,
+            max_concurrency=Config.LLM_MAX_CONCURRENCY,
+            max_queue=Config.LLM_MAX_QUEUE,
+            target_latency=Config.LLM_TARGET_LATENCY,
+        )
+    return limiters[provider]
+
+
+class LimitedLLM:
+    """
+    Wraps a chat model with the limiter of its provider, retrying throttled and
+    transient failures with jittered exponential backoff
+    """
+    def __init__(self, model, provider: str, deterministic: bool = False):
+        self.model = model
+        self.provider = provider
+        self.deterministic = deterministic  # temperature 0, its results may be reused
+        self.limiter = get_limiter(provider)
+
+
+    async def ainvoke(self, messages, config=None, **kwargs):
+        attempt = 0
+        while True:
+            await self.limiter.acquire()
+            start = time.perf_counter()
+            try:
+                result = await self.model.ainvoke(messages, config, **kwargs)
+            except Exception as e:
+                self.limiter.record(time.perf_counter() - start, error=True, throttled=is_throttled(e))
+                if attempt >= Config.LLM_MAX_RETRIES or not is_retryable(e):
+                    raise
+            else:
+                self.limiter.record(time.perf_counter() - start)
+                return result
+            finally:
+                self.limiter.release()
+
+            # full jitter, the slot is not held while backing off
+            delay = min(Config.LLM_BACKOFF_MAX, Config.LLM_BACKOFF_BASE * 2 ** attempt)
+            attempt += 1
+            metrics.incr(f"limiter.{self.provider}.retries")
+            await asyncio.sleep(random.uniform(0, delay))
+
+
+    async def astream(self, messages, config=None, **kwargs):
+        await self.limiter.acquire()
+        start = time.perf_counter()
+        try:
+            async for chunk in self.model.astream(messages, config, **kwargs):
+                yield chunk
+        except Exception as e:
+            self.limiter.record(time.perf_counter() - start, error=True, throttled=is_throttled(e))
+            raise
+        else:
+            self.limiter.record(time.perf_counter() - start)
+        finally:
+            self.limiter.release()
+
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
@@ -3,34 +3,70 @@ from langchain_ollama import ChatOllama
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_together import ChatTogether
 
+from rag.core.coalesce import CoalescingLLM
+from rag.core.limiter import LimitedLLM
+from rag.core.fake import FakeChatModel
+from rag.core.providers import ProviderGroup
+
 
 class LLM:
     def __init__(self, mode='cloud'):
 
         self.local_model = Config.OLLAMA_MODEL_ID
 
+        # the primary provider first, then the secondaries used for hedging and failover
+        modes = [mode] + [m for m in Config.LLM_SECONDARY if m != mode]
+        core_members, json_members = [], []
+        for provider_mode in modes:
+            core_llm, json_llm, core_provider, json_provider = self.build(provider_mode)
+            # calls to a provider share its rate limit, concurrency cap and queue
+            core_members.append(LimitedLLM(core_llm, core_provider))
+            json_members.append(LimitedLLM(json_llm, json_provider, deterministic=json_provider == 'together'))
+        self.core_llm = ProviderGroup("core", core_members)
+        self.json_llm = ProviderGroup("json", json_members)
+
+        # identical concurrent calls share one request, results are only reused
+        # when they come from a temperature 0 provider (Together for the json llm)
+        self.core_llm = CoalescingLLM(self.core_llm, "core")
+        self.json_llm = CoalescingLLM(self.json_llm, "json")
+
+
+    def build(self, mode: str):
+        """
+        Creates the core and json models of a provider mode
+
+        Returns:
+            core model, json model, core provider name, json provider name
+        """
         if mode == 'local':
-            self.core_llm = ChatOllama(
+            core_llm = ChatOllama(
                 model=self.local_model, 
                 temperature=0.3
             )
-            self.json_llm = ChatOllama(
+            json_llm = ChatOllama(
                 model=self.local_model, 
                 temperature=0.3, 
                 format="json"
             )
+            return core_llm, json_llm, 'ollama', 'ollama'
         elif mode == 'cloud':
-            self.core_llm = ChatGoogleGenerativeAI(
+            core_llm = ChatGoogleGenerativeAI(
                 model='gemini-2.0-flash',
-                temperature=0.3
+                temperature=0.3,
+                max_retries=0  # retried by the limiter
             )
             # ChatTogether is bugged and is not working on latest (3.xx somthing)
             # Currently using refs/pr for package fix (someguy)
             json_llm = ChatTogether(
                 model='meta-llama/Llama-3.3-70B-Instruct-Turbo-Free', 
                 temperature=0, 
-                api_key=Config.TOGETHER_API_KEY
+                api_key=Config.TOGETHER_API_KEY,
+                max_retries=0
             )
             # also the bind function is not working as it seems to
             # so prompting the llm to be strict (ref - Prompts Class)
-            self.json_llm = json_llm.bind(response_format={"type": "json_object"})
\ No newline at end of file
+            json_llm = json_llm.bind(response_format={"type": "json_object"})
+            return core_llm, json_llm, 'gemini', 'together'
+        elif mode == 'fake':
+            return FakeChatModel(), FakeChatModel(json_mode=True), 'fake', 'fake'
+        raise ValueError(f"Unknown llm mode {mode}")
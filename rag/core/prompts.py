@@ -3,6 +3,16 @@ class Prompts:
     SIMPLE_PROMPT = """Question : {question}
 Previous Chats : {chat_history}"""
 
+    SUMMARY_PROMPT = """Here is the summary of a conversation so far:
+
+{summary}
+
+Here are the messages that followed:
+
+{messages}
+
+Write an updated summary of the whole conversation in a few short paragraphs. Keep the topics, facts, names and open questions the user may refer back to. Give only the summary:"""
+
     RAG_PROMPT = """You are an assistant for question-answering tasks. 
 
 Here is the context to use to answer the question:
@@ -38,6 +48,15 @@ Return only JSON with single key, binary_score, that is 'yes' or 'no' score to i
 eg: {{"binary_score": "answer"}}"""
 
 
+    DOC_BATCH_GRADER_PROMPT = """Here are the retrieved documents: \n\n {documents} \n\n Here is the user question: \n\n {question}. 
+
+This carefully and objectively assess each document on its own, whether it contains at least some information that is relevant to the question.
+
+Return only JSON with single key, scores, mapping every document id to 'yes' or 'no' score to indicate whether that document contains at least some information that is relevant to the question.
+
+eg: {{"scores": {{"0": "answer", "1": "answer"}}}}"""
+
+
 
     ROUTER_INSTRUCTIONS = """You are an expert at routing a user question to a vectorstore or web search or direcly generate response.
 
@@ -107,4 +126,30 @@ Avoid simply stating the correct answer at the outset."""
 
 Return only JSON with two two keys, binary_score is 'yes' or 'no' score to indicate whether the STUDENT ANSWER meets the criteria. And a key, explanation, that contains an explanation of the score.
 
-eg: {{"binary_score": "answer", "explanation": "answer"}}"""
\ No newline at end of file
+eg: {{"binary_score": "answer", "explanation": "answer"}}"""
+
+
+    GENERATION_GRADER_INSTRUCT = """You are a teacher grading a quiz. 
+
+You will be given FACTS, a QUESTION and a STUDENT ANSWER. 
+
+Here is the grade criteria to follow:
+
+(1) grounded: The STUDENT ANSWER is grounded in the FACTS and does not contain "hallucinated" information outside the scope of the FACTS.
+
+(2) useful: The STUDENT ANSWER helps to answer the QUESTION. It can contain extra information that is not explicitly asked for in the question.
+
+Score:
+
+Give each criteria its own score. A score of yes means that the student's answer meets the criteria, a score of no means it does not.
+
+Explain your reasoning in a step-by-step manner to ensure your reasoning and conclusion are correct. 
+
+Avoid simply stating the correct answer at the outset."""
+
+
+    GENERATION_GRADER_PROMPT = """FACTS: \n\n {documents} \n\n QUESTION: \n\n {question} \n\n STUDENT ANSWER: {generation}. 
+
+Return only JSON with three keys, grounded is 'yes' or 'no' score to indicate whether the STUDENT ANSWER is grounded in the FACTS, useful is 'yes' or 'no' score to indicate whether the STUDENT ANSWER helps to answer the QUESTION. And a key, explanation, that contains an explanation of the scores.
+
+eg: {{"grounded": "answer", "useful": "answer", "explanation": "answer"}}"""
\ No newline at end of file
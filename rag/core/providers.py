@@ -0,0 +1,149 @@
+import time
+import asyncio
+
+from collections import deque
+
+from config import Config
+from rag.metrics import metrics
+
+
+class ProviderHealth:
+    """
+    Sliding window of the latencies and outcomes of recent calls to one provider
+    """
+    def __init__(self, window: int):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.down_until = 0.0
+
+
+    def record(self, latency: float, error: bool):
+        self.outcomes.append(error)
+        if not error:
+            self.latencies.append(latency)
+
+
+    def percentile(self, p: float):
+        if len(self.latencies) < Config.HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+    def error_rate(self) -> float:
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+
+    def healthy(self) -> bool:
+        if self.down_until:
+            if time.monotonic() < self.down_until:
+                return False
+            # cooldown over, give the provider a fresh window
+            self.down_until = 0.0
+            self.outcomes.clear()
+        if len(self.outcomes) >= Config.FAILOVER_MIN_CALLS and self.error_rate() >= Config.FAILOVER_ERROR_RATE:
+            self.down_until = time.monotonic() + Config.FAILOVER_COOLDOWN
+            return False
+        return True
+
+
+class ProviderGroup:
+    """
+    Ordered providers serving one llm role. Calls go to the first healthy provider and
+    a duplicate is sent to the next one once the call outlives the primary's latency
+    percentile, the first answer wins. Providers erroring too often are skipped for
+    Config.FAILOVER_COOLDOWN seconds.
+    """
+    def __init__(self, role: str, members: list):
+        self.role = role
+        self.members = members
+        self.health = {member.provider: ProviderHealth(Config.HEDGE_WINDOW) for member in members}
+
+
+    def candidates(self) -> list:
+        healthy = [m for m in self.members if self.health[m.provider].healthy()]
+        if healthy:
+            return healthy
+        # everything is failing, least bad first
+        return sorted(self.members, key=lambda m: self.health[m.provider].error_rate())
+
+
+    async def call(self, member, messages, config, kwargs):
+        start = time.perf_counter()
+        try:
+            result = await member.ainvoke(messages, config, **kwargs)
+        except asyncio.CancelledError:
+            # a lost hedge race is still a latency sample, the slow calls are the tail
+            self.health[member.provider].record(time.perf_counter() - start, error=False)
+            raise
+        except Exception:
+            self.health[member.provider].record(time.perf_counter() - start, error=True)
+            metrics.incr(f"providers.{self.role}.{member.provider}.errors")
+            raise
+        self.health[member.provider].record(time.perf_counter() - start, error=False)
+        return result, member
+
+
+    def hedge_delay(self, member) -> float:
+        latency = self.health[member.provider].percentile(Config.HEDGE_PERCENTILE)
+        return max(Config.HEDGE_MIN_DELAY, latency if latency is not None else Config.HEDGE_DEFAULT_DELAY)
+
+
+    async def ainvoke(self, messages, config=None, **kwargs):
+        result, _ = await self.ainvoke_with_member(messages, config, **kwargs)
+        return result
+
+
+    async def ainvoke_with_member(self, messages, config=None, **kwargs):
+        """
+        Returns
+            result, member that answered
+        """
+        candidates = self.candidates()
+        primary = candidates[0]
+        if primary is not self.members[0]:
+            metrics.incr(f"providers.{self.role}.failover")
+        metrics.set(f"providers.{self.role}.primary", primary.provider)
+        if len(candidates) == 1 or not Config.HEDGE_ENABLED:
+            return await self.failover(candidates, messages, config, kwargs)
+
+        first = asyncio.ensure_future(self.call(primary, messages, config, kwargs))
+        pending = {first}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=self.hedge_delay(primary))
+            if done:
+                if first.exception() is None:
+                    return first.result()
+                return await self.failover(candidates[1:], messages, config, kwargs)
+
+            # the hedge does not report to the caller's callbacks so streamed
+            # tokens only ever come from one provider, when it wins the stream
+            # is reset to its answer (see AI.generate_stream)
+            metrics.incr(f"providers.{self.role}.hedged")
+            second = asyncio.ensure_future(self.call(candidates[1], messages, {**(config or {}), "callbacks": []}, kwargs))
+            pending = {first, second}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            metrics.incr(f"providers.{self.role}.hedge_wins")
+                        return task.result()
+            raise first.exception()
+        finally:
+            # also runs when the caller is cancelled
+            for task in pending:
+                task.cancel()
+
+
+    async def failover(self, candidates: list, messages, config, kwargs):
+        for i, member in enumerate(candidates):
+            try:
+                return await self.call(member, messages, config, kwargs)
+            except Exception:
+                if i == len(candidates) - 1:
+                    raise
+
+
+    def __getattr__(self, name):
+        return getattr(self.members[0], name)
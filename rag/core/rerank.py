@@ -0,0 +1,45 @@
+import asyncio
+import threading
+
+import numpy as np
+
+from config import Config
+
+
+class Reranker:
+    """
+    Local cross-encoder scoring (question, document) pairs on CPU.
+    The model is loaded on first use.
+    """
+    def __init__(self):
+        self.model = None
+        self.lock = threading.Lock()
+
+
+    def load(self):
+        with self.lock:
+            if self.model is None:
+                # optional model, only needed when DOC_GRADING_MODE is rerank
+                from sentence_transformers import CrossEncoder
+                self.model = CrossEncoder(Config.RERANK_MODEL, device='cpu', max_length=Config.RERANK_MAX_LENGTH)
+        return self.model
+
+
+    def score(self, question: str, texts: list) -> list:
+        """
+        Returns
+            scores: relevance of each text between 0 and 1
+        """
+        if not texts:
+            return []
+        model = self.load()
+        logits = model.predict([(question, text) for text in texts], batch_size=Config.RERANK_BATCH_SIZE)
+        return (1 / (1 + np.exp(-np.asarray(logits, dtype=float)))).tolist()
+
+
+    async def ascore(self, question: str, texts: list) -> list:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.score, question, texts)
+
+
+reranker = Reranker()
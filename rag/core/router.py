@@ -0,0 +1,99 @@
+import json
+import asyncio
+import threading
+
+import numpy as np
+
+from config import Config
+from rag.data_utils.vectorstore import db
+
+# labelled example questions, the centroid of each label is what questions are compared to
+ROUTE_PROTOTYPES = {
+    "vectorstore": [
+        "Explain the concept from the module notes",
+        "What is the definition of market structure?",
+        "Derive the formula given in the lecture",
+        "Summarize the chapter on data structures",
+        "What are the differences between these two theories?",
+        "Give the steps of the algorithm discussed in class",
+        "What does this acronym stand for in the course?",
+        "Answer the question from the previous year exam paper",
+    ],
+    "websearch": [
+        "What is the latest news today?",
+        "Who won the match yesterday?",
+        "What is the current price of bitcoin?",
+        "What is the weather forecast for tomorrow?",
+        "When is the next election?",
+        "What are the trending topics this week?",
+        "What did the company announce recently?",
+        "What is the exchange rate right now?",
+    ],
+    "generate": [
+        "Hi",
+        "Hello, how are you?",
+        "Thanks for the help",
+        "Good morning",
+        "Who are you?",
+        "Tell me a joke",
+        "Okay, bye",
+        "That was helpful, thank you",
+    ],
+}
+
+
+def normalize(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=float)
+    return vector / np.linalg.norm(vector)
+
+
+class EmbeddingRouter:
+    """
+    Routes a question by the cosine similarity of its embedding to the prototype
+    centroid of each route, and to the closest chunk of the vectorstore.
+    Returns no route when unsure so the llm router decides.
+    """
+    def __init__(self):
+        self.centroids = None
+        self.lock = threading.Lock()
+
+
+    def load_centroids(self) -> dict:
+        with self.lock:
+            if self.centroids is None:
+                prototypes = ROUTE_PROTOTYPES
+                if Config.ROUTER_PROTOTYPES:
+                    with open(Config.ROUTER_PROTOTYPES) as f:
+                        prototypes = json.load(f)
+                self.centroids = {
+                    label: normalize(np.mean([normalize(v) for v in db.embeddings.embed_documents(examples)], axis=0))
+                    for label, examples in prototypes.items()
+                }
+        return self.centroids
+
+
+    def route(self, question: str):
+        """
+        Returns
+            route: 'websearch', 'vectorstore', 'generate' or None when ambiguous
+        """
+        centroids = self.load_centroids()
+        embedding = normalize(db.embed_query(question))
+
+        scores = sorted(((float(np.dot(embedding, c)), label) for label, c in centroids.items()), reverse=True)
+        (best, label), (second, _) = scores[0], scores[1]
+        if best >= Config.ROUTER_MIN_SIMILARITY and best - second >= Config.ROUTER_MARGIN:
+            return label
+
+        # close enough to something in the notes
+        if Config.ROUTER_CORPUS_THRESHOLD and db.max_similarity(embedding) >= Config.ROUTER_CORPUS_THRESHOLD:
+            return "vectorstore"
+        return None
+
+
+    async def aroute(self, question: str):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.route, question)
+
+
+router = EmbeddingRouter()
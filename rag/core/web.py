@@ -1,14 +1,100 @@
+import json
+import asyncio
+
+from abc import ABC, abstractmethod
+
 from langchain_tavily import TavilySearch
 
-web_search_tool = TavilySearch(
-    max_results=5,
-    topic="general",
-    # include_answer=False,
-    # include_raw_content=False,
-    # include_images=False,
-    # include_image_descriptions=False,
-    # search_depth="basic",
-    # time_range="day",
-    # include_domains=None,
-    # exclude_domains=None
-)
\ No newline at end of file
+from config import Config
+from rag.cache import LRUCache
+from rag.metrics import metrics
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.split()).strip('"\'').lower()
+
+
+class SearchBackend(ABC):
+    """
+    Web search provider used by the websearch node
+    """
+    @abstractmethod
+    async def asearch(self, query: str) -> list:
+        """
+        Returns
+            results: list of result page contents
+        """
+
+
+class TavilyBackend(SearchBackend):
+    def __init__(self):
+        self.tool = TavilySearch(
+            max_results=5,
+            topic="general",
+            # include_answer=False,
+            # include_raw_content=False,
+            # include_images=False,
+            # include_image_descriptions=False,
+            # search_depth="basic",
+            # time_range="day",
+            # include_domains=None,
+            # exclude_domains=None
+        )
+
+
+    async def asearch(self, query: str) -> list:
+        docs = await self.tool.ainvoke({"query": query})
+        return [d["content"] for d in docs['results']]
+
+
+class FixtureBackend(SearchBackend):
+    """
+    Offline stand-in serving results from a JSON file mapping queries to lists of
+    result contents, the "*" entry answers unknown queries. Used to test and
+    benchmark the websearch path without network.
+    """
+    def __init__(self, path: str, latency: float = 0.0):
+        if not path:
+            raise ValueError("WEB_SEARCH_FIXTURES must be set to use the fixture web search backend")
+        self.latency = latency
+        with open(path) as f:
+            self.results = {normalize_query(q): r for q, r in json.load(f).items()}
+
+
+    async def asearch(self, query: str) -> list:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.results.get(normalize_query(query), self.results.get("*", []))
+
+
+class WebSearch:
+    """
+    Web search through the configured backend, results cached by normalized query
+    """
+    def __init__(self, backend: SearchBackend):
+        self.backend = backend
+        self.results = LRUCache(Config.WEB_CACHE_SIZE, Config.WEB_CACHE_TTL)
+        metrics.register_cache("web_search", self.results)
+
+
+    async def asearch(self, query: str) -> list:
+        key = normalize_query(query)
+        results = self.results.get(key)
+        if results is None:
+            with metrics.timer("web_search.backend"):
+                results = await self.backend.asearch(query)
+            self.results.set(key, results)
+        return results
+
+
+def get_backend() -> SearchBackend:
+    if Config.WEB_SEARCH_BACKEND == 'fixture':
+        return FixtureBackend(Config.WEB_SEARCH_FIXTURES, Config.WEB_SEARCH_FIXTURE_LATENCY)
+    return TavilyBackend()
+
+
+web_search_tool = WebSearch(get_backend())
+
+# (recent human messages, question) -> rewritten search query
+query_rewrites = LRUCache(Config.WEB_CACHE_SIZE, Config.WEB_CACHE_TTL)
+metrics.register_cache("web_query_rewrites", query_rewrites)
@@ -0,0 +1,108 @@
+import os
+import re
+import math
+import heapq
+import pickle
+import threading
+
+from collections import Counter
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    Persistent BM25 inverted index over the vectorstore chunks, keyed by chunk id
+    """
+    def __init__(self, path: str, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+
+        self.postings = {}  # term -> {chunk id: term frequency}
+        self.lengths = {}  # chunk id -> number of tokens
+        self.terms = {}  # chunk id -> unique terms, to remove a chunk from the postings
+        self.total_length = 0
+        self.dirty = False
+        self.lock = threading.Lock()
+
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                self.postings, self.lengths, self.terms, self.total_length = pickle.load(f)
+
+
+    def add(self, ids: list, texts: list):
+        with self.lock:
+            for chunk_id, text in zip(ids, texts):
+                self._remove(chunk_id)
+                counts = Counter(tokenize(text))
+                for term, tf in counts.items():
+                    self.postings.setdefault(term, {})[chunk_id] = tf
+                self.terms[chunk_id] = tuple(counts)
+                self.lengths[chunk_id] = sum(counts.values())
+                self.total_length += self.lengths[chunk_id]
+            self.dirty = True
+
+
+    def remove(self, ids: list):
+        with self.lock:
+            for chunk_id in ids:
+                self._remove(chunk_id)
+            self.dirty = True
+
+
+    def _remove(self, chunk_id: str):
+        for term in self.terms.pop(chunk_id, ()):
+            postings = self.postings[term]
+            del postings[chunk_id]
+            if not postings:
+                del self.postings[term]
+        self.total_length -= self.lengths.pop(chunk_id, 0)
+
+
+    def clear(self):
+        with self.lock:
+            self.postings, self.lengths, self.terms = {}, {}, {}
+            self.total_length = 0
+            self.dirty = True
+
+
+    def search(self, query: str, k: int = 4) -> list:
+        """
+        Returns
+            results: list of (chunk id, score) best first
+        """
+        with self.lock:
+            count = len(self.lengths)
+            if not count:
+                return []
+            avg_length = self.total_length / count
+            scores = {}
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.lengths[chunk_id] / avg_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            tmp = f"{self.path}.tmp"
+            with open(tmp, 'wb') as f:
+                pickle.dump((self.postings, self.lengths, self.terms, self.total_length), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.path)
+            self.dirty = False
+
+
+    def __len__(self):
+        return len(self.lengths)
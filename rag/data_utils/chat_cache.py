@@ -0,0 +1,143 @@
+import time
+import asyncio
+import weakref
+import threading
+
+from collections import OrderedDict
+
+from config import Config
+from rag.metrics import metrics
+
+MESSAGE_OVERHEAD = 200  # rough bytes per message besides its content
+
+
+class ChatHistoryCache:
+    """
+    Write-through cache of the message lists of recently active chats. Chats are
+    dropped least recently used first once the cache holds more than max_bytes of
+    messages, and after idle seconds without being read or written.
+    Only chats loaded whole are kept, so a cached list is always complete.
+    """
+    def __init__(self, max_bytes: int, idle: float):
+        self.max_bytes = max_bytes
+        self.idle = idle
+        self.data = OrderedDict()  # chat_id -> [messages, size, last_used]
+        self.locks = weakref.WeakValueDictionary()  # chat_id -> lock, alive while in use
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+
+    def lock(self, chat_id: str) -> asyncio.Lock:
+        """
+        Returns the lock serializing the writes to the chat
+        """
+        lock = self.locks.get(chat_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self.locks[chat_id] = lock
+        return lock
+
+
+    def message_size(self, message) -> int:
+        return len(message["content"]) + MESSAGE_OVERHEAD
+
+
+    def evict(self):
+        now = time.monotonic()
+        while self.data:
+            chat_id, (_, size, last_used) = next(iter(self.data.items()))
+            if self.size <= self.max_bytes and now - last_used < self.idle:
+                break
+            del self.data[chat_id]
+            self.size -= size
+
+
+    def touch(self, chat_id: str):
+        entry = self.data.get(chat_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[2] >= self.idle:
+            del self.data[chat_id]
+            self.size -= entry[1]
+            return None
+        entry[2] = time.monotonic()
+        self.data.move_to_end(chat_id)
+        return entry
+
+
+    def get(self, chat_id: str):
+        """
+        Returns
+            copy of the chat's messages or None when the chat is not cached
+        """
+        with self.lock:
+            entry = self.touch(chat_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return list(entry[0])
+
+
+    def __contains__(self, chat_id: str) -> bool:
+        with self.lock:
+            found = self.touch(chat_id) is not None
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return found
+
+
+    def put(self, chat_id: str, messages: list):
+        if self.max_bytes <= 0:
+            return
+        with self.lock:
+            old = self.data.pop(chat_id, None)
+            if old:
+                self.size -= old[1]
+            size = sum(self.message_size(m) for m in messages)
+            self.data[chat_id] = [list(messages), size, time.monotonic()]
+            self.size += size
+            self.evict()
+
+
+    def append(self, chat_id: str, message):
+        """
+        Adds a message written to Postgres to the chat if it is cached
+
+        Returns
+            copy of the chat's messages or None when the chat is not cached
+        """
+        with self.lock:
+            entry = self.touch(chat_id)
+            if entry is None:
+                return None
+            size = self.message_size(message)
+            entry[0].append(message)
+            entry[1] += size
+            self.size += size
+            messages = list(entry[0])
+            self.evict()
+            return messages
+
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self.data),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+    def __len__(self):
+        return len(self.data)
+
+
+chat_cache = ChatHistoryCache(Config.CHAT_CACHE_MAX_BYTES, Config.CHAT_CACHE_IDLE)
+metrics.register_cache("chat_history", chat_cache)
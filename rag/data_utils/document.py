@@ -1,9 +1,13 @@
 import os
+import gc
+import time
 
 from pathlib import Path
+from collections import defaultdict
 from docling.chunking import HybridChunker
 from docling_core.types.doc import ImageRefMode
 from docling.datamodel.base_models import InputFormat
+from docling.datamodel.settings import settings as docling_settings
 from docling.document_converter import DocumentConverter, PdfFormatOption
 from docling.datamodel.pipeline_options import PdfPipelineOptions, TableFormerMode, AcceleratorOptions, AcceleratorDevice
 from langchain_core.documents import Document
@@ -13,6 +17,16 @@ from config import Config
 
 IMAGE_RESOLUTION_SCALE = 2.0
 
+# 'fast' skips page and picture images and uses the fast table model,
+# 'full' keeps rendered images and accurate tables
+PROFILES = {
+    'fast': {"table_mode": TableFormerMode.FAST, "images": False},
+    'full': {"table_mode": TableFormerMode.ACCURATE, "images": True},
+}
+
+# per stage pipeline timings on every conversion result
+docling_settings.debug.profile_pipeline_timings = True
+
 
 class DocumentHandler:
     def __init__(self):
@@ -25,60 +39,98 @@ class DocumentHandler:
 
         self.output_dir = Path('/teamspace/studios/this_studio/RAG/dataset/')
 
-        accelerator_options = AcceleratorOptions(
-         num_threads=8, device=AcceleratorDevice.CUDA
-        )
+        # converters are built on first use of each profile
+        self.processors = {}
 
-        pipeline_options = PdfPipelineOptions(
-            accelerator_options = accelerator_options,
-            do_table_structure=True,
-            #do_ocr=True,
-            #ocr_options=TesseractOcrOptions(force_full_page_ocr=True, lang=["eng"]),
-            #ocr_options=EasyOcrOptions(force_full_page_ocr=True, lang=["en"]),
-            table_structure_options=dict(
-                do_cell_matching=False,
-                mode=TableFormerMode.ACCURATE
-            ),
-            generate_page_images=True,
-            generate_picture_images=True,
-            images_scale=IMAGE_RESOLUTION_SCALE
-        )
+        # seconds spent per stage since the last pop_timings
+        self.timings = defaultdict(float)
 
-        format_options = {InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)}
 
-        self.processor = DocumentConverter(format_options=format_options)
+    def get_processor(self, profile: str) -> DocumentConverter:
+        if profile not in self.processors:
+            settings = PROFILES[profile]
+            accelerator_options = AcceleratorOptions(
+             num_threads=Config.INGEST_THREADS, device=AcceleratorDevice(Config.INGEST_DEVICE)
+            )
 
+            pipeline_options = PdfPipelineOptions(
+                accelerator_options = accelerator_options,
+                do_table_structure=True,
+                #do_ocr=True,
+                #ocr_options=TesseractOcrOptions(force_full_page_ocr=True, lang=["eng"]),
+                #ocr_options=EasyOcrOptions(force_full_page_ocr=True, lang=["en"]),
+                table_structure_options=dict(
+                    do_cell_matching=False,
+                    mode=settings["table_mode"]
+                ),
+                generate_page_images=settings["images"],
+                generate_picture_images=settings["images"],
+                images_scale=IMAGE_RESOLUTION_SCALE if settings["images"] else 1.0
+            )
 
-    def convert(self, file: str, output='chunks') -> list:
+            format_options = {InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)}
+
+            self.processors[profile] = DocumentConverter(format_options=format_options)
+        return self.processors[profile]
+
+
+    def resolve_profile(self, file: str, profile: str = None) -> str:
         """
+        Returns
+            profile: the given profile, else the one set for the file type, else Config.INGEST_PROFILE
+        """
+        if profile:
+            return profile
+        extension = os.path.splitext(file)[1].lstrip('.').lower()
+        return Config.INGEST_PROFILE_TYPES.get(extension, Config.INGEST_PROFILE)
+
+
+    def pop_timings(self) -> dict:
+        timings = dict(self.timings)
+        self.timings.clear()
+        return timings
+
+
+    def convert(self, file: str, output='chunks', profile: str = None) -> list:
+        """
+        Args:
+            profile: ingestion profile, see PROFILES
         Returns
             documents: list of all processed documents
         """
-        processed = []
+        if output == 'md':
+            return self.make_markdown(self.iter_convert(file, profile))
+        elif output == 'chunks':
+            return self.make_chunks(self.iter_convert(file, profile))
+        return []
+
+
+    def iter_convert(self, file: str, profile: str = None):
+        """
+        Converts a file, url or every file in a folder one document at a time,
+        so only one converted document is held in memory
+        Yields
+            document: converted document
+        """
         if file.startswith('http') or os.path.isfile(file):
-            result = self.processor.convert(file)
-            processed.append(result.document)
+            results = [file]
         else:
             # suppose the path is a folder
-            files = get_all_files(file)
-            results = self.processor.convert_all(files)
-            for result in results:
-                processed.append(result.document)
-            """for file in files:
-                result = converter.convert(file)
-                processed.append(result.document)"""
+            results = get_all_files(file)
 
-        if output == 'md':
-            return self.make_markdown(processed)
-        elif output == 'chunks':
-            return self.make_chunks(processed)
-        return []
+        for path in results:
+            start = time.perf_counter()
+            result = self.get_processor(self.resolve_profile(path, profile)).convert(path)
+            self.timings["convert"] += time.perf_counter() - start
+            for stage, item in (result.timings or {}).items():
+                self.timings[f"docling.{stage}"] += sum(item.times)
+            yield result.document
 
 
     def make_markdown(self, docs: list) -> list:
         """
         Args:
-            docs: list of processed documents
+            docs: iterable of processed documents
         Returns:
             files: list of markdown files
         """
@@ -94,27 +146,54 @@ class DocumentHandler:
     def make_chunks(self, files):
         """
         Args:
-            files: list of converted files
+            files: iterable of converted files
         Returns:
             chunks: list of file group (list) containing chunks (list)
         """
         file_group = []
         for file in files:
-            chunk_iter = self.chunker.chunk(dl_doc=file)
-            doc_chunks = []
-            for chunk in list(chunk_iter):
-                enriched_text = self.chunker.serialize(chunk)
-                doc = Document(
-                    enriched_text,
-                    metadata = {
-                        "filename": chunk.meta.origin.filename,
-                        "title": chunk.meta.headings[0] if chunk.meta.headings else 'Undefined'
-                    }
-                )
-                doc_chunks.append(doc)
-            file_group.append(list(doc_chunks)) 
+            file_group.append(self.chunk_document(file))
         
         return file_group
 
+    def chunk_document(self, file) -> list:
+        """
+        Args:
+            file: converted file
+        Returns:
+            chunks: list of chunks
+        """
+        start = time.perf_counter()
+        doc_chunks = []
+        for chunk in self.chunker.chunk(dl_doc=file):
+            enriched_text = self.chunker.serialize(chunk)
+            doc = Document(
+                enriched_text,
+                metadata = {
+                    "filename": chunk.meta.origin.filename,
+                    "title": chunk.meta.headings[0] if chunk.meta.headings else 'Undefined'
+                }
+            )
+            doc_chunks.append(doc)
+        self.timings["chunk"] += time.perf_counter() - start
+        return doc_chunks
+
+
+def convert_file(path: str, profile: str = None):
+    """
+    Converts and chunks a single file with the handler of the current process,
+    used as the entry point of ingestion worker processes
+    Returns
+        path, chunks: list of (text, metadata), timings: seconds per stage, error: message or None
+    """
+    try:
+        chunks = [(d.page_content, d.metadata) for group in doc_handler.convert(path, profile=profile) for d in group]
+        return path, chunks, doc_handler.pop_timings(), None
+    except Exception as e:
+        return path, [], doc_handler.pop_timings(), str(e)
+    finally:
+        # converted documents hold page images in reference cycles, free them before the next file
+        gc.collect()
+
         
 doc_handler = DocumentHandler()
@@ -0,0 +1,258 @@
+import os
+import json
+import time
+import hashlib
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from langchain_core.documents import Document
+
+from collections import defaultdict
+
+from config import Config
+from rag.metrics import metrics
+from rag.utils import get_all_files
+from rag.data_utils.vectorstore import db
+from rag.data_utils.document import convert_file
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_ids(path: str, content_hash: str, count: int) -> list:
+    """
+    Deterministic vectorstore ids for the chunks of one version of a file,
+    so the manifest only needs to store the chunk count
+    """
+    prefix = hashlib.sha1(path.encode()).hexdigest()[:16]
+    return [f"{prefix}-{content_hash[:16]}-{i}" for i in range(count)]
+
+
+class Manifest:
+    """
+    Persistent record of ingested files: path -> size, mtime, content hash and chunk count.
+    Saved after every write, it is also the checkpoint an interrupted run resumes from.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.files = {}
+        if os.path.isfile(path):
+            with open(path) as f:
+                self.files = json.load(f)
+
+
+    def chunk_ids(self, path: str) -> list:
+        entry = self.files[path]
+        return chunk_ids(path, entry["hash"], entry["chunks"])
+
+
+    def save(self):
+        # write then rename so an interrupted save never corrupts the manifest
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.files, f)
+        os.replace(tmp, self.path)
+
+
+class BatchWriter:
+    """
+    Buffers converted files and writes their chunks with batched add_datas calls.
+    A file is recorded in the manifest only once all of its chunks are written,
+    and the manifest is saved after every flush.
+    """
+    def __init__(self, manifest: Manifest, batch_size: int):
+        self.manifest = manifest
+        self.batch_size = max(1, batch_size)
+        self.files = []
+        self.buffered = 0
+        self.seconds = 0.0
+
+
+    def write(self, path: str, entry: dict, chunks: list):
+        documents = []
+        for text, metadata in chunks:
+            metadata["source"] = path
+            documents.append(Document(page_content=text, metadata=metadata))
+        self.files.append((path, entry, documents))
+        self.buffered += len(documents)
+        if self.buffered >= self.batch_size:
+            self.flush()
+
+
+    def flush(self):
+        if not self.files:
+            return
+        start = time.perf_counter()
+        old_ids, documents, ids = [], [], []
+        for path, entry, docs in self.files:
+            if path in self.manifest.files:
+                old_ids.extend(self.manifest.chunk_ids(path))
+            entry["chunks"] = len(docs)
+            documents.extend(docs)
+            ids.extend(chunk_ids(path, entry["hash"], len(docs)))
+
+        db.delete_datas(old_ids)
+        for i in range(0, len(documents), self.batch_size):
+            db.add_datas(documents[i:i + self.batch_size], ids=ids[i:i + self.batch_size])
+
+        for path, entry, _ in self.files:
+            self.manifest.files[path] = entry
+        self.manifest.save()
+        self.files = []
+        self.buffered = 0
+        self.seconds += time.perf_counter() - start
+
+
+class Ingestor:
+    def __init__(self):
+        self.manifest = Manifest(Config.INGEST_MANIFEST)
+
+
+    def sync(self, folder: str, workers: int = None, profile: str = None) -> dict:
+        """
+        Brings the vectorstore in line with the files under the folder.
+        Unchanged files are skipped, changed files have their chunks replaced
+        and chunks of deleted files are removed. Files are streamed through
+        convert, chunk and write one at a time, so memory stays bounded by the
+        largest file and an interrupted run resumes from the last written file.
+        Args:
+            workers: conversion processes, 1 converts in this process (default Config.INGEST_WORKERS)
+            profile: ingestion profile for every file, by default chosen per file type
+        Returns
+            stats: count of added, updated, unchanged, removed and failed files with throughput
+            and seconds spent per stage
+        """
+        start = time.perf_counter()
+        workers = workers or Config.INGEST_WORKERS
+        stats = {"added": 0, "updated": 0, "unchanged": 0, "removed": 0, "failed": 0, "chunks": 0}
+        timings = defaultdict(float)
+
+        folder = os.path.abspath(folder)
+        files = [os.path.abspath(f) for f in get_all_files(folder)]
+        present = set(files)
+
+        for path in list(self.manifest.files):
+            if path.startswith(folder + os.sep) and path not in present:
+                db.delete_datas(self.manifest.chunk_ids(path))
+                del self.manifest.files[path]
+                stats["removed"] += 1
+        self.manifest.save()
+
+        pending = {}
+        for path in files:
+            entry = self.check_file(path)
+            if entry is None:
+                stats["unchanged"] += 1
+            else:
+                pending[path] = entry
+
+        writer = BatchWriter(self.manifest, Config.INGEST_BATCH_SIZE)
+        if workers > 1:
+            results = self.convert_parallel(list(pending), workers, profile)
+        else:
+            results = (convert_file(path, profile) for path in pending)
+
+        try:
+            for path, chunks, file_timings, error in results:
+                for stage, seconds in file_timings.items():
+                    timings[stage] += seconds
+                    metrics.observe(f"ingest.{stage}", seconds)
+                if error:
+                    print(f"Failed to ingest {path} : {error}")
+                    stats["failed"] += 1
+                    continue
+                stats["updated" if path in self.manifest.files else "added"] += 1
+                stats["chunks"] += len(chunks)
+                writer.write(path, pending[path], chunks)
+                if workers <= 1:
+                    # serial runs checkpoint every file
+                    writer.flush()
+        finally:
+            writer.flush()
+            self.manifest.save()
+            db.persist()
+
+        timings["write"] = writer.seconds
+        elapsed = time.perf_counter() - start
+        stats["timings"] = {stage: round(seconds, 2) for stage, seconds in timings.items()}
+        converted = stats["added"] + stats["updated"]
+        stats["seconds"] = round(elapsed, 2)
+        stats["docs_per_sec"] = round(converted / elapsed, 2) if elapsed else 0.0
+        return stats
+
+
+    def check_file(self, path: str):
+        """
+        Returns
+            entry: new manifest entry if the file needs converting, None when unchanged
+        """
+        stat = os.stat(path)
+        entry = self.manifest.files.get(path)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return None
+
+        content_hash = file_hash(path)
+        if entry and entry["hash"] == content_hash:
+            entry["mtime"] = stat.st_mtime
+            return None
+
+        return {"size": stat.st_size, "mtime": stat.st_mtime, "hash": content_hash}
+
+
+    def convert_parallel(self, paths: list, workers: int, profile: str = None):
+        """
+        Converts files in a pool of worker processes, each owning its own converter
+        and chunker. At most Config.INGEST_MAX_PENDING files are queued at a time so
+        converted chunks never pile up faster than the writer stores them.
+        Files whose worker failed, and all the remaining ones once the pool breaks
+        (e.g. a worker killed for memory), are converted in this process instead.
+        Yields
+            path, chunks, timings, error
+        """
+        max_pending = max(workers, Config.INGEST_MAX_PENDING)
+        queue = iter(paths)
+        fallback = []
+        # spawn, docling and torch are not fork safe
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = {}  # future -> path
+
+            def submit():
+                for path in queue:
+                    futures[pool.submit(convert_file, path, profile)] = path
+                    if len(futures) >= max_pending:
+                        break
+
+            try:
+                submit()
+                while futures:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        path = futures.pop(future)
+                        try:
+                            result = future.result()
+                        except BrokenProcessPool:
+                            raise
+                        except Exception as e:
+                            print(f"Worker failed on {path} : {e}")
+                            fallback.append(path)
+                            continue
+                        yield result
+                    submit()
+            except BrokenProcessPool as e:
+                print(f"---INGEST WORKER POOL BROKEN ({e}), CONTINUING SERIALLY---")
+                metrics.incr("ingest.pool_broken")
+                fallback.extend(futures.values())
+                fallback.extend(queue)
+
+        for path in fallback:
+            yield convert_file(path, profile)
+
+
+ingestor = Ingestor()
@@ -1,4 +1,6 @@
+import json
 import uuid
+import base64
 import asyncpg
 
 from datetime import datetime
@@ -6,6 +8,33 @@ from asyncpg.pool import Pool
 
 from config import Config
 from rag.types import ChatMessage, ChatSession
+from rag.data_utils.chat_cache import chat_cache
+
+def encode_cursor(values: list) -> str:
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str, types: list) -> list:
+    """
+    Returns the cursor values, checked against the types of the page's sort keys
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError
+        decoded = []
+        for value, kind in zip(values, types):
+            if kind is datetime and isinstance(value, str):
+                decoded.append(datetime.fromisoformat(value))
+            elif kind is int and isinstance(value, int) and not isinstance(value, bool):
+                decoded.append(value)
+            else:
+                raise ValueError
+        return decoded
+    except Exception:
+        raise ValueError("Invalid cursor")
+
 
 class PgDatabase:
     db: Pool
@@ -15,7 +44,11 @@ class PgDatabase:
 
 
     async def connect(self):
-        self.db = await asyncpg.create_pool(Config.DATABASE_URL)
+        self.db = await asyncpg.create_pool(
+            Config.DATABASE_URL,
+            min_size=Config.PG_POOL_MIN,
+            max_size=Config.PG_POOL_MAX
+        )
         await self.setup_db()
 
 
@@ -47,6 +80,17 @@ class PgDatabase:
                     content TEXT NOT NULL,
                     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 );
+
+                CREATE TABLE IF NOT EXISTS chat_summaries (
+                    chat_id TEXT PRIMARY KEY REFERENCES chats(chat_id) ON DELETE CASCADE,
+                    summary TEXT NOT NULL,
+                    covered INTEGER NOT NULL,
+                    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+
+                -- chat lists, last message lookups and history reads, id breaks timestamp ties
+                CREATE INDEX IF NOT EXISTS chats_username_last_updated_idx ON chats (username, last_updated DESC, id DESC);
+                CREATE INDEX IF NOT EXISTS messages_chat_timestamp_idx ON messages (chat_id, timestamp, id);
             """)
 
 
@@ -72,57 +116,208 @@ class PgDatabase:
             return ChatSession(chatId=new_chat_id, title=title, lastUpdated=datetime.utcnow(), messages=[])
 
 
+    async def fetch_messages(self, conn, chat_id: str):
+        messages = await conn.fetch("SELECT role, content, timestamp FROM messages WHERE chat_id = $1 ORDER BY id", chat_id)
+        return [ChatMessage(role=m["role"], content=m["content"], timestamp=m["timestamp"]) for m in messages]
+
+
     async def get_chat_messages(self, chat_id: str):
-        async with self.db.acquire() as conn:
-            messages = await conn.fetch("SELECT role, content, timestamp FROM messages WHERE chat_id = $1", chat_id)
-            return [ChatMessage(role=m["role"], content=m["content"], timestamp=m["timestamp"]) for m in messages]
+        messages = chat_cache.get(chat_id)
+        if messages is not None:
+            return messages
+        # under the chat lock, so a write can't land between the read and the fill
+        async with chat_cache.lock(chat_id):
+            async with self.db.acquire() as conn:
+                messages = await self.fetch_messages(conn, chat_id)
+            chat_cache.put(chat_id, messages)
+        return messages
 
 
     async def save_message(self, chat_id: str, role: str, content: str):
-        async with self.db.acquire() as conn:
-            await conn.execute(
-                "INSERT INTO messages (chat_id, role, content) VALUES ($1, $2, $3)",
-                chat_id, role, content
-            )
+        async with chat_cache.lock(chat_id):
+            async with self.db.acquire() as conn:
+                timestamp = await conn.fetchval(
+                    "INSERT INTO messages (chat_id, role, content) VALUES ($1, $2, $3) RETURNING timestamp",
+                    chat_id, role, content
+                )
+            chat_cache.append(chat_id, ChatMessage(role=role, content=content, timestamp=timestamp))
 
-    
-    async def get_all_chats(self, username):
+
+    async def begin_turn(self, username: str, chat_id: str, content: str):
+        """
+        Stores the user message of a chat turn, creating the user and chat when missing, and
+        reads back the chat history and summary. One transaction on one connection, the
+        statements are prepared once per connection by asyncpg's statement cache.
+        The history of chats in the chat cache is not read back.
+
+        Returns
+            chat_id, messages, summary: rolling summary or None, covered: number of messages it folds in
+        """
+        chat_id = chat_id or str(uuid.uuid4())
+        # writes to a chat are serialized so the cached list keeps the insertion order
+        async with chat_cache.lock(chat_id):
+            cached = chat_id in chat_cache
+            async with self.db.acquire() as conn:
+                async with conn.transaction():
+                    # foreign keys are checked at the end of the statement, after every insert ran.
+                    # users are registered beforehand, a missing one gets a placeholder that can't log in
+                    timestamp = await conn.fetchval("""
+                        WITH new_user AS (
+                            INSERT INTO users (username, hashed_password) VALUES ($1, '')
+                            ON CONFLICT (username) DO NOTHING
+                        ), new_chat AS (
+                            INSERT INTO chats (chat_id, username, title) VALUES ($2, $1, 'New Chat')
+                            ON CONFLICT (chat_id) DO NOTHING
+                        )
+                        INSERT INTO messages (chat_id, role, content) VALUES ($2, 'human', $3)
+                        RETURNING timestamp
+                    """,
+                        username, chat_id, content
+                    )
+                    if not cached:
+                        messages = await self.fetch_messages(conn, chat_id)
+                    summary = await conn.fetchrow("SELECT summary, covered FROM chat_summaries WHERE chat_id = $1", chat_id)
+
+                if cached:
+                    messages = chat_cache.append(chat_id, ChatMessage(role="human", content=content, timestamp=timestamp))
+                    if messages is None:
+                        # evicted meanwhile, read it back
+                        messages = await self.fetch_messages(conn, chat_id)
+                        chat_cache.put(chat_id, messages)
+                else:
+                    chat_cache.put(chat_id, messages)
+
+        if summary:
+            return chat_id, messages, summary["summary"], summary["covered"]
+        return chat_id, messages, None, 0
+
+
+    async def finish_turn(self, chat_id: str, content: str):
+        """
+        Stores the assistant message of a chat turn and bumps the chat's last_updated in one statement
+        """
+        async with chat_cache.lock(chat_id):
+            async with self.db.acquire() as conn:
+                timestamp = await conn.fetchval("""
+                    WITH touched AS (
+                        UPDATE chats SET last_updated = CURRENT_TIMESTAMP WHERE chat_id = $1
+                    )
+                    INSERT INTO messages (chat_id, role, content) VALUES ($1, 'assistant', $2)
+                    RETURNING timestamp
+                """,
+                    chat_id, content
+                )
+            chat_cache.append(chat_id, ChatMessage(role="assistant", content=content, timestamp=timestamp))
+
+
+    async def get_chat_summary(self, chat_id: str):
+        """
+        Returns
+            summary: rolling summary of the oldest messages or None, covered: number of messages it folds in
+        """
         async with self.db.acquire() as conn:
-            chats = await conn.fetch("""
-                SELECT c.chat_id, c.title, c.username, c.last_updated
-                FROM chats c
-                WHERE c.username = $1
-                ORDER BY c.last_updated DESC
-            """, 
-                username
-            )
-            return chats
+            row = await conn.fetchrow("SELECT summary, covered FROM chat_summaries WHERE chat_id = $1", chat_id)
+            if row:
+                return row["summary"], row["covered"]
+            return None, 0
 
-    async def get_last_message(self, chat_id):
+
+    async def save_chat_summary(self, chat_id: str, summary: str, covered: int):
         async with self.db.acquire() as conn:
-            last_message = await conn.fetchrow("""
-                SELECT content 
-                FROM messages 
-                WHERE chat_id = $1 
-                ORDER BY timestamp DESC 
-                LIMIT 1
+            await conn.execute("""
+                INSERT INTO chat_summaries (chat_id, summary, covered) VALUES ($1, $2, $3)
+                ON CONFLICT (chat_id) DO UPDATE
+                SET summary = EXCLUDED.summary, covered = EXCLUDED.covered, last_updated = CURRENT_TIMESTAMP
             """, 
-                chat_id
+                chat_id, summary, covered
             )
-            return last_message
 
+    
+    async def fetch_page(self, query: str, args: list, keys: list, limit: int, before: str = None, after: str = None,
+                         descending: bool = False, from_end: bool = False):
+        """
+        Runs a keyset paginated query, query has {cursor} (an AND condition) and {order} slots
 
-    async def get_all_messages(self, chat_id):
+        Args:
+            keys: (column, type) of the ordering columns, unique together
+            limit: rows per page
+            before / after: cursor of the page to continue from, towards smaller / larger keys
+            descending: order of the returned rows
+            from_end: whether the first page holds the largest keys
+        Returns:
+            rows, cursor of the following page in the same direction or None
+        """
+        backwards = from_end
+        condition = ""
+        if before or after:
+            backwards = bool(before)
+            cursor = decode_cursor(before or after, [kind for _, kind in keys])
+            placeholders = ", ".join(f"${len(args) + i + 1}" for i in range(len(keys)))
+            condition = f"AND ({', '.join(key for key, _ in keys)}) {'<' if backwards else '>'} ({placeholders})"
+            args = [*args, *cursor]
+
+        order = ", ".join(f"{key} {'DESC' if backwards else 'ASC'}" for key, _ in keys)
+        sql = query.format(cursor=condition, order=order) + f" LIMIT ${len(args) + 1}"
         async with self.db.acquire() as conn:
-            messages = await conn.fetch("""
+            rows = await conn.fetch(sql, *args, limit + 1)
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor([rows[-1][key.split('.')[-1]] for key, _ in keys])
+        if backwards != descending:
+            rows = rows[::-1]
+        return rows, next_cursor
+
+
+    async def get_chats_page(self, username: str, limit: int, before: str = None, after: str = None, preview: int = 50):
+        """
+        A page of the user's chats with the first preview + 1 characters of their last message
+        (last_message, None for empty chats), most recently updated first. The first page holds the latest chats.
+        """
+        return await self.fetch_page("""
+                SELECT c.id, c.chat_id, c.title, c.username, c.last_updated, m.last_message
+                FROM chats c
+                LEFT JOIN LATERAL (
+                    SELECT LEFT(content, $2) AS last_message
+                    FROM messages
+                    WHERE chat_id = c.chat_id
+                    ORDER BY timestamp DESC, id DESC
+                    LIMIT 1
+                ) m ON TRUE
+                WHERE c.username = $1 {cursor}
+                ORDER BY {order}
+            """,
+            [username, preview + 1], [("c.last_updated", datetime), ("c.id", int)], limit, before, after, descending=True, from_end=True
+        )
+
+
+    async def get_messages_page(self, chat_id: str, limit: int, before: str = None, after: str = None):
+        """
+        A page of the chat's messages, oldest first. The first page holds the latest messages.
+        """
+        return await self.fetch_page("""
                 SELECT id, chat_id, role, content, timestamp
                 FROM messages
-                WHERE chat_id = $1
-                ORDER BY timestamp ASC
-            """, 
-                chat_id
-            )
-            return messages
+                WHERE chat_id = $1 {cursor}
+                ORDER BY {order}
+            """,
+            [chat_id], [("timestamp", datetime), ("id", int)], limit, before, after, from_end=True
+        )
+
+
+    async def get_users_page(self, limit: int, before: str = None, after: str = None):
+        """
+        A page of users in registration order
+        """
+        return await self.fetch_page("""
+                SELECT id, username, email, full_name, disabled, is_admin
+                FROM users
+                WHERE TRUE {cursor}
+                ORDER BY {order}
+            """,
+            [], [("id", int)], limit, before, after
+        )
 
 
 pgdb = PgDatabase()
\ No newline at end of file
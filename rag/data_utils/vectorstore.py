@@ -1,7 +1,19 @@
+import os
+import copy
+import json
+import uuid
+import asyncio
+
+import numpy as np
+
+from langchain_core.documents import Document
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_chroma import Chroma
 
 from config import Config
+from rag.cache import LRUCache
+from rag.metrics import metrics
+from rag.data_utils.bm25 import BM25Index
 
 
 class ChromaDB:
@@ -9,6 +21,15 @@ class ChromaDB:
 
         self.persist_dir = Config.DATASET_DB_DIR
 
+        # bumped on every corpus change so caches can drop stale results
+        self.version = 0
+
+        # normalized query -> embedding, and (query, k, filter, version) -> documents
+        self.query_embeddings = LRUCache(Config.QUERY_CACHE_SIZE)
+        self.results = LRUCache(Config.RETRIEVAL_CACHE_SIZE)
+        metrics.register_cache("query_embeddings", self.query_embeddings)
+        metrics.register_cache("retrieval_results", self.results)
+
         self.embeddings = HuggingFaceEmbeddings(
             model_name=Config.EMBEDDING_MODEL,
             model_kwargs={'device': 'cpu'}
@@ -23,12 +44,117 @@ class ChromaDB:
  			embedding_function=self.embeddings
         )
 
-    def add_datas(self, documents: list):
-        self.vectordb.add_documents(documents=documents)
+        # lexical index over the same chunks, rebuilt when it does not match the collection
+        self.bm25 = BM25Index(os.path.join(self.persist_dir or '.', 'bm25.pkl'))
+        if len(self.bm25) != self.vectordb._collection.count():
+            self.rebuild_bm25()
+
+    def add_datas(self, documents: list, ids: list = None):
+        if not documents:
+            return
+        ids = ids or [str(uuid.uuid4()) for _ in documents]
+        # chunks with existing ids are overwritten
+        self.vectordb.add_documents(documents=documents, ids=ids)
+        self.bm25.add(ids, [d.page_content for d in documents])
+        self.version += 1
+        self.results.clear()
+
+    def delete_datas(self, ids: list):
+        if not ids:
+            return
+        self.vectordb.delete(ids=ids)
+        self.bm25.remove(ids)
+        self.version += 1
+        self.results.clear()
+
+    def persist(self):
+        """
+        Saves the lexical index, called once after a batch of writes (e.g. at the end of an ingest).
+        An index left behind by an interrupted run is rebuilt on load since its size no longer matches.
+        """
+        self.bm25.save()
+
+    def rebuild_bm25(self):
+        print("---REBUILDING BM25 INDEX---")
+        self.bm25.clear()
+        results = self.vectordb.get(include=['documents'])
+        self.bm25.add(results['ids'], results['documents'])
+        self.persist()
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        # whitespace only, the embedding model is case sensitive
+        return " ".join(query.split())
 
-    def search(self, query:str):
-        result = self.vectordb.similarity_search(query, 4)
-        return result
+    def embed_query(self, query: str) -> list:
+        # the normalized text is embedded, so every query sharing a cache key gets the same vector
+        key = self.normalize_query(query)
+        embedding = self.query_embeddings.get(key)
+        if embedding is None:
+            embedding = self.embeddings.embed_query(key)
+            self.query_embeddings.set(key, embedding)
+        return embedding
+
+    def search(self, query:str, k: int = 4, filter: dict = None, mode: str = None):
+        """
+        Args:
+            mode: 'dense' similarity search or 'hybrid' dense and BM25 results fused
+                  by reciprocal rank (default Config.SEARCH_MODE)
+        """
+        mode = mode or Config.SEARCH_MODE
+        key = (self.normalize_query(query), k, json.dumps(filter, sort_keys=True), mode, self.version)
+        result = self.results.get(key)
+        if result is None:
+            embedding = self.embed_query(query)
+            if mode == 'hybrid':
+                result = self.hybrid_search(query, embedding, k, filter)
+            else:
+                result = self.vectordb.similarity_search_by_vector(embedding, k, filter=filter)
+            self.results.set(key, result)
+        # callers extend the list and may change the documents they get back
+        return copy.deepcopy(result)
+
+    def hybrid_search(self, query: str, embedding: list, k: int, filter: dict = None):
+        fetch_k = k * Config.HYBRID_FETCH_MULTIPLIER
+        dense = self.vectordb.similarity_search_by_vector(embedding, fetch_k, filter=filter)
+        lexical = self.bm25.search(query, fetch_k)
+
+        scores, documents = {}, {}
+        for rank, doc in enumerate(dense):
+            scores[doc.id] = scores.get(doc.id, 0.0) + 1 / (Config.RRF_K + rank + 1)
+            documents[doc.id] = doc
+        for rank, (chunk_id, _) in enumerate(lexical):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1 / (Config.RRF_K + rank + 1)
+
+        top = sorted(scores, key=scores.get, reverse=True)[:k]
+        missing = [chunk_id for chunk_id in top if chunk_id not in documents]
+        if missing:
+            found = self.vectordb.get(ids=missing, where=filter, include=['documents', 'metadatas'])
+            for chunk_id, text, metadata in zip(found['ids'], found['documents'], found['metadatas']):
+                documents[chunk_id] = Document(page_content=text, metadata=metadata or {}, id=chunk_id)
+        return [documents[chunk_id] for chunk_id in top if chunk_id in documents]
+
+    async def asearch(self, query:str, k: int = 4, filter: dict = None, mode: str = None):
+        # query embedding is CPU bound, keep it off the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.search, query, k, filter, mode)
+
+    async def aembed_query(self, query: str) -> list:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.embed_query, query)
+
+    def max_similarity(self, embedding) -> float:
+        """
+        Returns
+            similarity: cosine similarity of the closest chunk to the embedding, 0 when empty
+        """
+        if not len(self.bm25):
+            return 0.0
+        result = self.vectordb._collection.query(
+            query_embeddings=[list(map(float, embedding))], n_results=1, include=['embeddings']
+        )
+        closest = np.asarray(result['embeddings'][0][0], dtype=float)
+        return float(np.dot(embedding, closest) / (np.linalg.norm(embedding) * np.linalg.norm(closest)))
 
     def list_documents(self):
         results = self.vectordb.get(include=['metadatas'])
@@ -0,0 +1,64 @@
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class Metrics:
+    """
+    In-process counters and timings, served by /admin/metrics
+    """
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.timings = {}
+        self.gauges = {}
+        self.caches = {}
+
+
+    def incr(self, name: str, value=1):
+        self.counters[name] += value
+
+
+    def set(self, name: str, value):
+        self.gauges[name] = value
+
+
+    def observe(self, name: str, seconds: float):
+        count, total, peak = self.timings.get(name, (0, 0.0, 0.0))
+        self.timings[name] = (count + 1, total + seconds, max(peak, seconds))
+
+
+    def register_cache(self, name: str, cache):
+        """
+        Reports the stats() of the cache in every snapshot
+        """
+        self.caches[name] = cache
+
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+
+    def snapshot(self) -> dict:
+        timings = {}
+        for name, (count, total, peak) in self.timings.items():
+            timings[name] = {
+                "count": count,
+                "total": round(total, 4),
+                "avg": round(total / count, 4),
+                "max": round(peak, 4),
+            }
+        return {
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+            "timings": timings,
+            "caches": {name: cache.stats() for name, cache in self.caches.items()},
+        }
+
+
+metrics = Metrics()
@@ -25,13 +25,19 @@ class UserSession(TypedDict):
 
 class GraphState(TypedDict):
     question: str
+    route: Optional[str]
     generation: Optional[str]
+    grounded: Optional[bool]
     web_search: Optional[str]
     max_retries: int
     answers: int
     loop_step: int
     documents: List[str]  # Store document content as strings
-    chat_history: List[ChatMessage]
+    fetched_sources: List[str]  # normalized web search queries already fetched this turn
+    search_exhausted: Optional[bool]  # a web search retry had nothing new to fetch
+    context: Optional[str]  # documents packed into the token budget for the last generation
+    chat_history: List[ChatMessage]  # recent messages kept verbatim
+    history_summary: Optional[str]  # rolling summary of the older messages
     user_id: str
     chat_id: str
 
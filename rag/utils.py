@@ -1,6 +1,8 @@
 import os
 
+from functools import lru_cache
 
+from config import Config
 
 
 def get_all_files(root_folder):
@@ -18,4 +20,27 @@ def format_doc_text(docs:list):
     """
     Returns formatted text from multiple documents
     """
-    return "\n\n".join(doc.page_content for doc in docs)
\ No newline at end of file
+    return "\n\n".join(doc.page_content for doc in docs)
+
+
+@lru_cache(maxsize=1)
+def get_tokenizer():
+    # loaded on first use, same tokenizer the chunks were sized with
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(Config.EMBEDDING_MODEL)
+
+
+def count_tokens(text: str) -> int:
+    """
+    Returns number of embedding model tokens in the text
+    """
+    return len(get_tokenizer().encode(text, add_special_tokens=False))
+
+
+def format_chat_history(messages: list):
+    """
+    Returns chat messages as Human/Assistant lines
+    """
+    return "".join(
+        f"{'Human: ' if msg['role'] == 'human' else 'Assistant: '}{msg['content']}\n" for msg in messages
+    )
\ No newline at end of file
@@ -0,0 +1,7 @@
+import os
+
+# offline settings, read when config is first imported
+os.environ.setdefault("ENV", "test")
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/test")
+os.environ.setdefault("LLM_MODE", "fake")
+os.environ.setdefault("FAKE_LLM_LATENCY", "0.01")
@@ -0,0 +1,152 @@
+import time
+import asyncio
+
+import pytest
+
+from config import Config
+from rag.core.fake import FakeChatModel, FakeRateLimitError
+from rag.core.limiter import (
+    BACKGROUND, INTERACTIVE, LimitedLLM, ProviderLimiter, QueueFullError, llm_priority, limiters,
+)
+
+
+def make_limiter(name, rate=0, burst=1, max_concurrency=4, max_queue=10, target_latency=10):
+    return ProviderLimiter(name, rate, burst, max_concurrency, max_queue, target_latency)
+
+
+class FlakyModel:
+    """
+    Fails with the given errors before answering
+    """
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def ainvoke(self, messages, config=None, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+@pytest.fixture
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(Config, "LLM_BACKOFF_BASE", 0.001)
+    monkeypatch.setattr(Config, "LLM_BACKOFF_MAX", 0.01)
+    monkeypatch.setattr(Config, "LLM_MAX_RETRIES", 3)
+
+
+def test_rate_limit_spaces_requests():
+    limiter = make_limiter("rate", rate=50, burst=1)
+
+    async def run():
+        start = time.perf_counter()
+        for _ in range(6):
+            await limiter.acquire()
+            limiter.release()
+        return time.perf_counter() - start
+
+    # one token up front, then one every 20ms
+    assert asyncio.run(run()) >= 0.09
+
+
+def test_throttled_caller_holds_no_slot():
+    limiter = make_limiter("token_first", rate=10, burst=1, max_concurrency=1)
+
+    async def run():
+        await limiter.acquire()
+        limiter.release()
+        waiting = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0.02)
+        active_while_waiting = limiter.active
+        await waiting
+        limiter.release()
+        return active_while_waiting
+
+    assert asyncio.run(run()) == 0
+
+
+def test_interactive_calls_are_served_first():
+    limiter = make_limiter("priority", max_concurrency=1)
+    order = []
+
+    async def call(name, level):
+        with llm_priority(level):
+            await limiter.acquire()
+        order.append(name)
+        limiter.release()
+
+    async def run():
+        await limiter.acquire()
+        tasks = [
+            asyncio.ensure_future(call("background", BACKGROUND)),
+            asyncio.ensure_future(call("interactive", INTERACTIVE)),
+        ]
+        await asyncio.sleep(0.01)
+        limiter.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert order == ["interactive", "background"]
+
+
+def test_full_queue_sheds_calls():
+    limiter = make_limiter("shed", max_concurrency=1, max_queue=1)
+
+    async def run():
+        await limiter.acquire()
+        queued = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0.01)
+        with pytest.raises(QueueFullError):
+            await limiter.acquire()
+        limiter.release()
+        await queued
+        limiter.release()
+
+    asyncio.run(run())
+
+
+def test_throttling_is_retried_and_halves_concurrency(fast_backoff):
+    limiters.pop("retry", None)
+    model = FlakyModel([FakeRateLimitError("429 rate limit exceeded")] * 2)
+    llm = LimitedLLM(model, "retry")
+    before = llm.limiter.limit
+
+    assert asyncio.run(llm.ainvoke([])) == "ok"
+    assert model.calls == 3
+    assert llm.limiter.limit < before
+    assert llm.limiter.active == 0
+
+
+def test_non_retryable_errors_are_raised(fast_backoff):
+    limiters.pop("fatal", None)
+    model = FlakyModel([ValueError("bad request")])
+    llm = LimitedLLM(model, "fatal")
+
+    with pytest.raises(ValueError):
+        asyncio.run(llm.ainvoke([]))
+    assert model.calls == 1
+    assert llm.limiter.active == 0
+
+
+def test_retries_give_up_after_max_retries(fast_backoff):
+    limiters.pop("exhausted", None)
+    model = FlakyModel([FakeRateLimitError("429 rate limit exceeded")] * 10)
+    llm = LimitedLLM(model, "exhausted")
+
+    with pytest.raises(FakeRateLimitError):
+        asyncio.run(llm.ainvoke([]))
+    assert model.calls == Config.LLM_MAX_RETRIES + 1
+
+
+def test_fake_provider_under_load(fast_backoff):
+    limiters.pop("fake_load", None)
+    llm = LimitedLLM(FakeChatModel(latency=0.005, error_rate=0.3), "fake_load")
+
+    async def run():
+        return await asyncio.gather(*[llm.ainvoke([]) for _ in range(30)], return_exceptions=True)
+
+    results = asyncio.run(run())
+    answered = [r for r in results if not isinstance(r, Exception)]
+    assert len(answered) >= 25
+    assert llm.limiter.active == 0
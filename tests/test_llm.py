@@ -0,0 +1,30 @@
+import json
+import asyncio
+
+from langchain_core.messages import HumanMessage
+
+from rag.core.llm import LLM
+from rag.metrics import metrics
+
+
+def test_fake_llm_answers_through_coalescing():
+    llm = LLM("fake")
+
+    async def run():
+        messages = [HumanMessage(content="What is a token bucket?")]
+        return await asyncio.gather(llm.core_llm.ainvoke(messages), llm.core_llm.ainvoke(messages))
+
+    coalesced = metrics.counters["llm.core.coalesced"]
+    first, second = asyncio.run(run())
+    assert first.content and first.content == second.content
+    # the second identical call shared the first one's request
+    assert metrics.counters["llm.core.coalesced"] == coalesced + 1
+
+
+def test_fake_json_llm_is_not_cached():
+    llm = LLM("fake")
+    result = asyncio.run(llm.json_llm.ainvoke([HumanMessage(content="Route this question")]))
+    assert json.loads(result.content)["datasource"] == "vectorstore"
+    # the fake provider samples, its results are never reused
+    assert not llm.json_llm.deterministic
+    assert len(llm.json_llm.results) == 0
@@ -0,0 +1,36 @@
+import asyncio
+
+from config import Config
+from rag.core import funcs
+
+
+class NoLLM:
+    @property
+    def json_llm(self):
+        raise AssertionError("the llm router should not be called")
+
+
+def test_first_turn_question_is_routed_locally(monkeypatch):
+    question = "How do I reset my password?"
+
+    async def aroute(query):
+        assert query == question
+        return "vectorstore"
+
+    monkeypatch.setattr(Config, "ROUTER_MODE", "embedding")
+    monkeypatch.setattr(funcs.router, "aroute", aroute)
+    monkeypatch.setattr(funcs, "llm", NoLLM())
+
+    # begin_turn saves the question first, so a first turn's history holds just that message
+    chat_history = [{"role": "human", "content": question}]
+    assert asyncio.run(funcs.choose_route(question, question, chat_history)) == "vectorstore"
+
+
+def test_follow_up_question_is_routed_by_llm(monkeypatch):
+    monkeypatch.setattr(Config, "ROUTER_MODE", "embedding")
+    chat_history = [
+        {"role": "human", "content": "How do I reset my password?"},
+        {"role": "ai", "content": "Use the reset link on the login page."},
+        {"role": "human", "content": "And if that fails?"},
+    ]
+    assert not funcs.routes_locally(chat_history)